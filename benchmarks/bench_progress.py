@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    micro benchmarks for the hot paths of progression
+
+        python benchmarks/bench_progress.py                        # all cases, JSON to stdout
+        python benchmarks/bench_progress.py -o 0.1.3.json          # JSON to file
+        python benchmarks/bench_progress.py -k render -k calc      # only matching cases
+        python benchmarks/bench_progress.py --quick                # fewer repeats, no 10k bars
+        python benchmarks/bench_progress.py --compare 0.1.3.json   # ratio to an earlier run
+
+    Each case is run `repeat` times with `number` operations per run, the
+    JSON result holds the best and the median time per operation (seconds).
+    The best time is the one to compare between releases, the median shows
+    how noisy the machine was.
+
+    Cases:
+
+        increment   - cost of one counter increment per counter type and number
+                      of processes writing to the same counter
+        calc        - Progress._calc for one bar, with and without progress
+        render      - render_frame for each bar class at 1, 100 and 10k bars
+        esc         - remove_ESC_SEQ_from_string and ESC_SEQ_to_HTML throughput
+                      for a rendered frame (MB/s), the same frame again and again
+                      (cached lines) or a new frame each call starting with empty caches
+        loop        - latency of Loop.start and Loop.stop
+        interference - throughput of a CPU bound worker while a busy loop process runs
+                      with and without cpu_affinity / sched_idle (see set_scheduling)
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import logging
+import os
+import multiprocessing as mp
+import platform
+import sys
+import time
+
+# setup path to import progression
+from os.path import abspath, dirname, split
+sys.path = [split(dirname(abspath(__file__)))[0]] + sys.path
+
+import progression
+from progression import progress
+
+clock = getattr(time, 'perf_counter', time.time)
+
+BENCHMARKS = []
+
+def benchmark(name):
+    """
+        register func as benchmark case name, func(quick) yields the results
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return decorator
+
+def timeit(func, number, repeat, setup=None):
+    """
+        call func() number times in each of repeat runs, returns the
+        time per call of all runs (seconds)
+
+        setup is called before each run and not timed
+    """
+    times = []
+    for r in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = clock()
+        for n in range(number):
+            func()
+        times.append((clock() - t0) / number)
+    return times
+
+def result(name, params, times, number, bytes_per_op=None):
+    times = sorted(times)
+    res = {'name'  : name,
+           'params': params,
+           'unit'  : 's/op',
+           'number': number,
+           'repeat': len(times),
+           'best'  : times[0],
+           'median': times[len(times)//2]}
+    if bytes_per_op is not None:
+        res['MB/s'] = bytes_per_op / times[0] / 1e6
+    return res
+
+def _repeat(quick):
+    return 3 if quick else 7
+
+# -------------------------------------------------------------------------
+#   counters
+# -------------------------------------------------------------------------
+
+COUNTER_TYPES = [('UnsignedIntValue', progression.UnsignedIntValue),
+                 ('FloatValue'      , progression.FloatValue),
+                 ('RawValue'        , lambda: mp.RawValue('I', 0))]
+
+def _increment_locked(c, n, start):
+    start.wait()
+    for i in range(n):
+        with c.get_lock():
+            c.value += 1
+
+def _increment_raw(c, n, start):
+    start.wait()
+    for i in range(n):
+        c.value += 1
+
+@benchmark('increment')
+def bench_increment(quick):
+    number = 10000 if quick else 100000
+    for type_name, counter in COUNTER_TYPES:
+        # a RawValue has no lock, more than one writer would lose increments
+        for writers in ([1] if type_name == 'RawValue' else [1, 2, 4]):
+            target = _increment_raw if type_name == 'RawValue' else _increment_locked
+            times = []
+            for r in range(_repeat(quick)):
+                c = counter()
+                start = mp.Event()
+                procs = [mp.Process(target=target, args=(c, number, start)) for w in range(writers)]
+                for p in procs:
+                    p.start()
+                # wait until the processes run, only the increments are timed
+                time.sleep(0.05)
+                t0 = clock()
+                start.set()
+                for p in procs:
+                    p.join()
+                times.append((clock() - t0) / (number*writers))
+                assert (type_name != 'RawValue') or (c.value == number)
+            yield result('increment', {'type': type_name, 'writers': writers}, times, number*writers)
+
+# -------------------------------------------------------------------------
+#   statistics
+# -------------------------------------------------------------------------
+
+@benchmark('calc')
+def bench_calc(quick):
+    number = 10000 if quick else 100000
+    c = progression.UnsignedIntValue()
+    m = progression.UnsignedIntValue(number)
+    pb = progression.ProgressBar(count=c, max_count=m)
+    args = (pb.count[0], pb.last_count[0], pb.start_time[0], pb.max_count[0],
+            pb.speed_calc_cycles, pb.q[0], pb.last_speed[0], pb.lock[0])
+
+    def calc_progress():
+        c.value += 1
+        progress.Progress._calc(*args)
+
+    def calc_no_progress():
+        progress.Progress._calc(*args)
+
+    for changed, func in [(True, calc_progress), (False, calc_no_progress)]:
+        times = timeit(func, number, _repeat(quick), setup=pb._reset_all)
+        yield result('calc', {'count_changed': changed}, times, number)
+
+# -------------------------------------------------------------------------
+#   rendering
+# -------------------------------------------------------------------------
+
+def _columns_render():
+    layout = progression.ColumnLayout(progression.ProgressBarColumns.default_columns)
+    layout.set_label_width(6)
+    return layout.render
+
+RENDERERS = [('ProgressBar'            , lambda: progression.ProgressBar.render),
+             ('ProgressBarCounter'     , lambda: progression.ProgressBarCounter.render),
+             ('ProgressBarFancy'       , lambda: progression.ProgressBarFancy.render),
+             ('ProgressBarCounterFancy', lambda: progression.ProgressBarCounterFancy.render),
+             ('ProgressBarColumns'     , _columns_render)]
+
+def _snapshots(n_bars, frame=0):
+    """
+        the statistics of n_bars bars at the given frame, taken from a
+        virtual clock so all runs render the very same frames
+    """
+    old_clock = progression.set_clock(progression.VirtualClock(start=frame, wall_start=1.5e9+frame))
+    try:
+        kwargs = {'counter_count': [progression.UnsignedIntValue(3)],
+                  'counter_speed': [progression.FloatValue(0.1)],
+                  'init_time'    : 0}
+        snapshots = []
+        for i in range(n_bars):
+            count = (37*i + 11*frame) % 1001
+            max_count = None if i % 10 == 9 else 1000
+            snapshots.append(progress.Progress.snapshot(count, max_count, "{}:".format(i), 12.3 + i % 7,
+                                                        frame + i % 100, 1 + (1000 - count) / 12.3,
+                                                        0, **kwargs))
+        return snapshots
+    finally:
+        progression.set_clock(old_clock)
+
+@benchmark('render')
+def bench_render(quick):
+    theme = progression.color_themes['term_default']
+    for n_bars in ([1, 100] if quick else [1, 100, 10000]):
+        number = max(1, (200 if quick else 2000) // n_bars)
+        frames = [_snapshots(n_bars, frame) for frame in range(number)]
+        for cls_name, get_render in RENDERERS:
+            render = get_render()
+            times = []
+            for r in range(_repeat(quick)):
+                t0 = clock()
+                for snapshots in frames:
+                    progression.render_frame(render, snapshots, 80, theme, info_line="info")
+                times.append((clock() - t0) / number)
+            yield result('render', {'class': cls_name, 'bars': n_bars}, times, number)
+
+# -------------------------------------------------------------------------
+#   escape sequences
+# -------------------------------------------------------------------------
+
+ESC_FUNCS = [('remove_ESC_SEQ_from_string', progression.remove_ESC_SEQ_from_string),
+             ('ESC_SEQ_to_HTML'           , progression.ESC_SEQ_to_HTML)]
+
+def _clear_ESC_caches():
+    progress._remove_ESC_cache.clear()
+    progress._HTML_LINE_CACHE.clear()
+    progress._HTML_TRANSITION_CACHE.clear()
+
+@benchmark('esc')
+def bench_esc(quick):
+    theme = progression.color_themes['term_default']
+    number = 100 if quick else 1000
+    frames = [progression.render_frame(progression.ProgressBarFancy.render, _snapshots(10, frame),
+                                       80, theme, info_line="info")
+              for frame in range(number)]
+    n_bytes = sum(len(f.encode('utf8')) for f in frames) / number
+    for func_name, func in ESC_FUNCS:
+        for frames_kind in ['same', 'new']:
+            times = []
+            for r in range(_repeat(quick)):
+                if frames_kind == 'new':
+                    _clear_ESC_caches()
+                t0 = clock()
+                if frames_kind == 'same':
+                    for f in frames:
+                        func(frames[0])
+                else:
+                    for f in frames:
+                        func(f)
+                times.append((clock() - t0) / number)
+            yield result('esc', {'func': func_name, 'frames': frames_kind}, times, number,
+                         bytes_per_op=n_bytes)
+
+# -------------------------------------------------------------------------
+#   loop
+# -------------------------------------------------------------------------
+
+def _noop():
+    pass
+
+@benchmark('loop')
+def bench_loop(quick):
+    repeat = 5 if quick else 20
+    t_start = []
+    t_stop = []
+    for r in range(repeat):
+        loop = progression.Loop(func=_noop, interval=0.01)
+        t0 = clock()
+        loop.start()
+        t1 = clock()
+        time.sleep(0.05)
+        t2 = clock()
+        loop.stop()
+        t3 = clock()
+        t_start.append(t1 - t0)
+        t_stop.append(t3 - t2)
+    yield result('loop', {'op': 'start'}, t_start, 1)
+    yield result('loop', {'op': 'stop'}, t_stop, 1)
+
+# -------------------------------------------------------------------------
+#   interference of the loop process with the workers
+# -------------------------------------------------------------------------
+
+def _worker(cpu, start, duration, iterations):
+    """
+        CPU bound worker pinned to cpu, counts its iterations within duration
+    """
+    progression.set_scheduling(cpu_affinity=[cpu])
+    start.wait()
+    n = 0
+    t_end = clock() + duration
+    while clock() < t_end:
+        for i in range(1000):
+            pass
+        n += 1
+    iterations.value = n
+
+def _render_load(snapshots, theme):
+    # an expensive display: 1000 fancy bars per frame without writing them anywhere
+    progression.render_frame(progression.ProgressBarFancy.render, snapshots, 80, theme)
+
+@benchmark('interference')
+def bench_interference(quick):
+    """
+        throughput of a CPU bound worker pinned to one CPU while a busy loop process
+        (1000 fancy bars, interval 10ms) runs
+            none             - without loop process (reference)
+            unpinned         - default scheduling of the loop process
+            same_cpu         - the loop process pinned to the CPU of the worker
+            same_cpu_idle    - as same_cpu, with SCHED_IDLE
+            other_cpu        - the loop process pinned to another CPU (needs 2 CPUs)
+    """
+    if not hasattr(os, 'sched_getaffinity'):
+        print("interference: CPU affinity not supported, skipped", file=sys.stderr)
+        return
+    cpus = sorted(os.sched_getaffinity(0))
+    cpu = cpus[0]
+    duration = 0.5 if quick else 2
+    theme = progression.color_themes['term_default']
+    snapshots = _snapshots(1000)
+    scenarios = [('none'         , None),
+                 ('unpinned'     , {}),
+                 ('same_cpu'     , {'cpu_affinity': [cpu]}),
+                 ('same_cpu_idle', {'cpu_affinity': [cpu], 'sched_idle': True})]
+    if len(cpus) > 1:
+        scenarios.append(('other_cpu', {'cpu_affinity': [cpus[1]]}))
+
+    # a busy loop process does not stop within its interval, do not warn about it
+    log_level = progress.log.level
+    progress.log.setLevel(logging.ERROR)
+    try:
+        for res in _interference(scenarios, cpu, duration, snapshots, theme, quick):
+            yield res
+    finally:
+        progress.log.setLevel(log_level)
+
+def _interference(scenarios, cpu, duration, snapshots, theme, quick):
+    reference = None
+    for name, loop_kwargs in scenarios:
+        times = []
+        for r in range(_repeat(quick)):
+            start = mp.Event()
+            iterations = mp.Value('L', 0, lock=False)
+            worker = mp.Process(target=_worker, args=(cpu, start, duration, iterations))
+            worker.start()
+            loop = None
+            if loop_kwargs is not None:
+                loop = progression.Loop(func=_render_load, args=(snapshots, theme), interval=0.01, **loop_kwargs)
+                loop.start()
+            time.sleep(0.1)
+            start.set()
+            worker.join()
+            if loop is not None:
+                loop.stop()
+            times.append(duration / iterations.value)
+        res = result('interference', {'loop': name}, times, 1000)
+        if reference is None:
+            reference = res['best']
+        # worker throughput relative to the run without loop process
+        res['relative'] = reference / res['best']
+        yield res
+
+# -------------------------------------------------------------------------
+#   main
+# -------------------------------------------------------------------------
+
+def run(keywords=None, quick=False):
+    """
+        run all benchmarks whose name contains one of the keywords (all if None),
+        returns the results as dict (see module doc)
+    """
+    results = []
+    for name, func in BENCHMARKS:
+        if keywords and not any(k in name for k in keywords):
+            continue
+        for res in func(quick):
+            results.append(res)
+            print("{:<10} {:<60} {:.3e} s/op".format(res['name'], json.dumps(res['params'], sort_keys=True),
+                                                     res['best']), file=sys.stderr)
+    return {'version'  : progression.__version__,
+            'python'   : platform.python_version(),
+            'platform' : platform.platform(),
+            'cpu_count': mp.cpu_count(),
+            'timestamp': time.time(),
+            'quick'    : quick,
+            'results'  : results}
+
+def _key(res):
+    return res['name'], json.dumps(res['params'], sort_keys=True)
+
+def compare(new, old):
+    """
+        the ratio new/old of the best time for each case found in both runs
+    """
+    old_best = dict((_key(res), res['best']) for res in old['results'])
+    return [(_key(res), res['best'] / old_best[_key(res)])
+            for res in new['results'] if _key(res) in old_best]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="micro benchmarks for progression")
+    parser.add_argument('-o', '--output', help="write the JSON results to this file (default stdout)")
+    parser.add_argument('-k', dest='keywords', action='append',
+                        help="run only benchmarks whose name contains KEYWORDS (may be given several times)")
+    parser.add_argument('--quick', action='store_true', help="fewer repetitions and no 10k bars")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    res = run(keywords=args.keywords, quick=args.quick)
+    s = json.dumps(res, indent=2, sort_keys=True)
+    if args.output is None:
+        print(s)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(s + '\n')
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print("\nnew/old ({} vs {})".format(res['version'], old['version']), file=sys.stderr)
+        for (name, params), ratio in compare(res, old):
+            print("{:<10} {:<60} {:.2f}".format(name, params, ratio), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
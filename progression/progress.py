@@ -2,13 +2,19 @@
 # -*- coding: utf-8 -*-
 from __future__ import division, print_function
 
+import atexit
 import datetime
+import errno
+import heapq
 import io
 import logging
 import math
 import multiprocessing as mp
-from   multiprocessing.sharedctypes import Synchronized
+from   multiprocessing.sharedctypes import Synchronized, SynchronizedBase
+from   multiprocessing.queues import Queue as mpQueue
 import os
+import pickle
+import re
 import sys
 import signal
 import subprocess as sp
@@ -16,6 +22,7 @@ import threading
 import time
 import traceback
 import warnings
+from collections import namedtuple
 
 _IPYTHON = True
 try:
@@ -56,6 +63,9 @@ if sys.version_info[0] == 2:         # minor hacks to be python 2 and 3 compatib
 elif sys.version_info[0] == 3:
     inMemoryBuffer = io.StringIO
 
+# not affected by changes of the system time, falls back to time.time on python 2
+_monotonic = getattr(time, 'monotonic', time.time)
+
 
 class StdoutPipe(object):
     """replacement for stream objects such as stdout which
@@ -78,27 +88,269 @@ class StdoutPipe(object):
     """
     def __init__(self, conn):
         self.conn = conn
+        self.messages = 0
+        self.bytes = 0
         
     def flush(self):
         pass
     def write(self, b):
+        if not b:
+            # e.g. the line ending of print(..., end='')
+            return
         self.conn.send(b)
+        self.messages += 1
+        self.bytes += len(b)
+
+class _TimedStdoutPipe(StdoutPipe):
+    """
+        StdoutPipe which accounts the time spent sending as transport (see TickMetrics)
+    """
+    def __init__(self, conn, metrics):
+        StdoutPipe.__init__(self, conn)
+        self.metrics = metrics
+
+    def write(self, b):
+        t0 = self.metrics.clock()
+        StdoutPipe.write(self, b)
+        self.metrics.add('transport', self.metrics.clock() - t0)
+
+class _LogBatchHandler(logging.Handler):
+    """
+        collect the log records of the loop process and send them through the
+        output pipe to the parent, one batch for each call of the loop function
+        (see Loop._wrapper_func)
+
+        Consecutive records from the same line of code are coalesced into the
+        latest of them and at most capacity records are sent per batch, so a chatty
+        log level costs little more than creating the records. The records are
+        formatted (message and traceback only) when the batch is sent.
+    """
+    def __init__(self, conn, capacity=100):
+        logging.Handler.__init__(self)
+        self.conn = conn
+        self.capacity = capacity
+        self._records = []      # [record, number of records coalesced into it]
+        self._dropped = 0
+        self.messages = 0
+
+    def emit(self, record):
+        if self._records:
+            last = self._records[-1]
+            r = last[0]
+            if (r.lineno == record.lineno) and (r.pathname == record.pathname) and (r.levelno == record.levelno):
+                last[0] = record
+                last[1] += 1
+                return
+        if len(self._records) < self.capacity:
+            self._records.append([record, 1])
+        else:
+            self._dropped += 1
+
+    def _prepare(self, record, n):
+        msg = self.format(record)
+        if n > 1:
+            msg += " ({} similar records coalesced)".format(n-1)
+        record.msg = msg
+        record.message = msg
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def flush(self):
+        if not self._records:
+            return
+        records = [self._prepare(r, n) for r, n in self._records]
+        if self._dropped > 0:
+            records.append(logging.LogRecord(log.name, logging.WARNING, __file__, 0,
+                                             "{} log records dropped".format(self._dropped), None, None))
+        self._records = []
+        self._dropped = 0
+        try:
+            self.messages += 1
+            try:
+                self.conn.send(records)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                # e.g. an unpicklable attribute passed as extra, send the plain values only
+                self.conn.send([logging.makeLogRecord(dict((k, v) for k, v in r.__dict__.items()
+                                                           if isinstance(v, (str, int, float, type(None)))))
+                                for r in records])
+        except (IOError, OSError):
+            # the parent has gone
+            pass
+
+class LatestFrameBuffer(object):
+    """
+        buffer between the thread receiving the output of the loop process and
+        the thread writing it (see Loop)
+
+        A frame is the output of one progress update and ends with ESC_MY_MAGIC_ENDING.
+        When a frame is completed while an older complete frame is still waiting to be
+        written (e.g. because the terminal is slow), the older frame is dropped and
+        counted in dropped. So receiving never blocks and only the latest frame is
+        shown. A frame whose beginning has already been written is never dropped.
+        Output which does not consist of frames is passed on unchanged.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._chunks = []
+        self._frame_start = 0   # index of the first chunk after the last complete frame
+        self._protected = 0     # the first chunks which must not be dropped
+        self._partial = False   # the beginning of the current frame has already been fetched
+        self._closed = False
+        self._messages = []
+        self.dropped = 0
+
+    def put(self, b):
+        with self._cond:
+            self._chunks.append(b)
+            if b.endswith(ESC_MY_MAGIC_ENDING):
+                if self._partial:
+                    self._protected = len(self._chunks)
+                    self._partial = False
+                elif self._frame_start > self._protected:
+                    del self._chunks[self._protected:self._frame_start]
+                    self.dropped += 1
+                self._frame_start = len(self._chunks)
+            self._cond.notify()
+
+    def put_message(self, msg):
+        """
+            add a message which is to be shown above the frames, messages are never dropped
+        """
+        with self._cond:
+            self._messages.append(msg)
+            self._cond.notify()
+
+    def get_messages(self):
+        with self._cond:
+            messages = self._messages
+            self._messages = []
+            return messages
+
+    def get(self):
+        """
+            wait for output (or messages) and return all of the output, None means that
+            the buffer was closed and everything has been fetched
+        """
+        with self._cond:
+            while not self._chunks and not self._messages and not self._closed:
+                self._cond.wait()
+            if not self._chunks:
+                return None if (self._closed and not self._messages) else ""
+            b = "".join(self._chunks)
+            self._chunks = []
+            self._frame_start = 0
+            self._protected = 0
+            if b:
+                self._partial = not b.endswith(ESC_MY_MAGIC_ENDING)
+            return b
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
 
 class PipeToPrint(object):
     def __call__(self, b):
         print(b, end='')
+    def flush(self):
+        sys.stdout.flush()
+    def write_message(self, msg, erase=True):
+        """
+            print msg, if erase is True each line is erased before (it holds a bar)
+        """
+        for line in msg.split('\n'):
+            if erase:
+                print(ESC_ERASE_LINE + line)
+            else:
+                print(line)
+    def erase(self):
+        """
+            erase the bars, i.e. everything below the cursor
+        """
+        print(ESC_ERASE_DOWN, end='')
+        sys.stdout.flush()
 
 class PipeFromProgressToIPythonHTMLWidget(object):
-    def __init__(self):
-        self.htmlWidget = ipywidgets.widgets.HTML()
-        display(self.htmlWidget)
-        self._buff = ""
+    """
+        shows the progress in the IPython notebook
+
+        Each line of a frame (i.e. each bar) is shown by its own HTML widget and only
+        the widgets whose line has changed are updated. The front-end is updated at most
+        every min_interval seconds, a frame arriving in between is kept and shown with
+        the next update (or by flush).
+    """
+    def __init__(self, min_interval=0.1):
+        self.min_interval = min_interval
+        self.styleWidget = ipywidgets.widgets.HTML(
+            value='<style>.widget-html{font-family:monospace;white-space:pre}</style>')
+        self.lineWidgets = []
+        self.messageWidget = ipywidgets.widgets.HTML()
+        self.box = ipywidgets.widgets.VBox(children=[self.styleWidget, self.messageWidget])
+        display(self.box)
+        self._buff = []
+        self._pending = None
+        self._last_update = 0
+
     def __call__(self, b):
-        self._buff += b
+        self._buff.append(b)
         if b.endswith(ESC_MY_MAGIC_ENDING):
-            buff = ESC_SEQ_to_HTML(self._buff)
-            self.htmlWidget.value = '<style>.widget-html{font-family:monospace;white-space:pre}</style>'+buff
-            self._buff = ""
+            # b may hold several frames, only the last one is shown
+            frames = "".join(self._buff).split(ESC_MY_MAGIC_ENDING)
+            self._pending = frames[-2] + ESC_MY_MAGIC_ENDING
+            self._buff = []
+            if time.time() - self._last_update >= self.min_interval:
+                self.flush()
+
+    def flush(self):
+        """
+            send the most recent frame to the front-end
+        """
+        if self._pending is None:
+            return
+        lines = ESC_SEQ_to_HTML_lines(self._pending)
+        self._pending = None
+        self._last_update = time.time()
+
+        if len(lines) > len(self.lineWidgets):
+            for i in range(len(self.lineWidgets), len(lines)):
+                self.lineWidgets.append(ipywidgets.widgets.HTML())
+            self.box.children = [self.styleWidget, self.messageWidget] + self.lineWidgets
+
+        for i, w in enumerate(self.lineWidgets):
+            value = lines[i] if i < len(lines) else ''
+            if w.value != value:
+                w.value = value
+
+    def write_message(self, msg, erase=True):
+        """
+            show msg above the bars
+        """
+        self.messageWidget.value += "".join(l + '\n' for l in ESC_SEQ_to_HTML_lines(msg))
+
+    def erase(self):
+        # the log records go to the output stream of the notebook, not into the widgets
+        pass
+
+def _flush_pipe_handler(pipe_handler):
+    """
+        call the flush method of pipe_handler, a plain callable has none
+    """
+    flush = getattr(pipe_handler, 'flush', None)
+    if flush is not None:
+        flush()
+
+def _write_pipe_message(pipe_handler, msg, erase=True):
+    """
+        pass msg to the write_message method of pipe_handler, a plain callable
+        gets the message as ordinary output
+    """
+    write_message = getattr(pipe_handler, 'write_message', None)
+    if write_message is not None:
+        write_message(msg, erase=erase)
+    else:
+        pipe_handler(msg + '\n')
 
 PipeHandler = PipeToPrint
 def choose_pipe_handler(kind = 'print', color_theme = None):
@@ -119,6 +371,21 @@ def choose_pipe_handler(kind = 'print', color_theme = None):
         else:
             warnings.warn("can not choose ipythonHTML (IPython and/or ipywidgets were not loaded)")
 
+try:
+    from multiprocessing.connection import wait as mp_connection_wait
+except ImportError:
+    mp_connection_wait = None
+
+try:
+    from queue import Empty as QueueEmpty
+except ImportError:
+    from Queue import Empty as QueueEmpty
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
 try:
     from shutil import get_terminal_size as shutil_get_terminal_size
 except ImportError:
@@ -143,6 +410,62 @@ class LoopExceptionError(RuntimeError):
 class LoopInterruptError(Exception):
     pass
 
+class LoopTickTimeoutError(RuntimeError):
+    pass
+
+class TickReport(namedtuple('TickReport', ['pid', 'tick', 'duration', 'stack', 'action'])):
+    """
+        report of a call of the loop function which overran tick_timeout (see Loop)
+
+        pid - of the loop process
+        tick - number of the call (starting at 1)
+        duration - time in seconds the call has been running when the report was made
+        stack - formatted stack of the stuck call
+        action - 'report', 'abandon' or 'restart' (see Loop)
+    """
+    __slots__ = ()
+
+class _TickWatchdog(object):
+    """
+        enforce a deadline for each call of the loop function, used in the loop process
+
+        Uses SIGALRM (setitimer), so the handler runs in the main thread of the loop process
+        and sees the frame of the stuck call. Blocking system calls and lock acquisitions
+        are interrupted by the signal, long running C code can not be interrupted.
+    """
+    def __init__(self, timeout, action, reports):
+        self.timeout = timeout
+        self.action = action
+        self.reports = reports
+        self.tick = 0
+        self._t0 = None
+        signal.signal(signal.SIGALRM, self._alarm)
+
+    def arm(self):
+        self.tick += 1
+        self._t0 = time.time()
+        signal.setitimer(signal.ITIMER_REAL, self.timeout)
+
+    def disarm(self):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        self._t0 = None
+
+    def _alarm(self, signum, frame):
+        if self._t0 is None:
+            return
+        report = TickReport(pid      = os.getpid(),
+                            tick     = self.tick,
+                            duration = time.time() - self._t0,
+                            stack    = "".join(traceback.format_stack(frame)),
+                            action   = self.action)
+        log.warning("call %s of the loop function overran the timeout of %ss", report.tick, self.timeout)
+        log.info("stack of the stuck call\n%s", report.stack)
+        if self.reports is not None:
+            self.reports.put(report)
+        if self.action != 'report':
+            raise LoopTickTimeoutError("call {} of the loop function overran the timeout of {}s".format(
+                                       report.tick, self.timeout))
+
 def get_identifier(name=None, pid=None, bold=True):
     if pid is None:
         pid = os.getpid()
@@ -194,7 +517,15 @@ class Loop(object):
                  sigint                   = 'stop',
                  sigterm                  = 'stop',
                  auto_kill_on_last_resort = False,
-                 raise_error              = True):
+                 raise_error              = True,
+                 cpu_affinity             = None,
+                 nice                     = None,
+                 sched_idle               = False,
+                 max_restarts             = 0,
+                 restart_backoff          = 1,
+                 tick_timeout             = None,
+                 on_tick_timeout          = 'report',
+                 metrics                  = None):
         """
         func [callable] - function to be called periodically
         
@@ -212,7 +543,36 @@ class Loop(object):
         auto_kill_on_last_resort [bool] - If set False (default), ask user to send SIGKILL 
         to loop process in case normal stop and SIGTERM failed. If set True, send SIDKILL
         without asking.
-        
+
+        cpu_affinity [None, set of int] - CPUs the loop process may run on (Linux only)
+
+        nice [None, int] - increment of the niceness of the loop process
+
+        sched_idle [bool] - run the loop process with the SCHED_IDLE scheduling policy,
+        i.e. only when no other process wants the CPU (Linux only)
+
+        max_restarts [int] - if > 0, a supervisor thread restarts the loop process at most
+        max_restarts times when it crashed (an exception in func, killed by a signal, ...)
+
+        restart_backoff [pos number] - time to wait before the first restart, the waiting
+        time doubles with each restart (at most 60s) and is reset after a process has
+        been running for 60s
+
+        tick_timeout [None, pos number] - deadline for a single call of func. A call which
+        overruns it is reported (see get_tick_reports) with its stack (uses SIGALRM in the
+        loop process, Unix only).
+
+        on_tick_timeout [string] - what to do with an overrunning call
+            report: only report it, the call continues
+            abandon: interrupt the call (LoopTickTimeoutError is raised in func) and
+                continue with the next one
+            restart: interrupt the call and exit the loop process with an error,
+                combine with max_restarts to get a fresh process
+
+        metrics [None, bool, TickMetrics] - record the timings of the stages of each
+        tick (see TickMetrics), True creates a TickMetrics instance, the recorded
+        timings are available via the attribute metrics
+
         the signal handler string may be one of the following
             ing: ignore the incoming signal
             stop: raise InterruptedError which is caught silently.
@@ -236,7 +596,39 @@ class Loop(object):
         self._auto_kill_on_last_resort = auto_kill_on_last_resort
         log.debug("auto_kill_on_last_resort = %s", self._auto_kill_on_last_resort)
         
+        self._sched = {'cpu_affinity': cpu_affinity,
+                       'nice'        : nice,
+                       'sched_idle'  : sched_idle}
+
+        self._max_restarts = max_restarts
+        self._restart_backoff = restart_backoff
+
+        if on_tick_timeout not in ('report', 'abandon', 'restart'):
+            raise ValueError("on_tick_timeout must be one of 'report', 'abandon' or 'restart'")
+        if tick_timeout is not None:
+            self._tick_reports = mp.Queue()
+        else:
+            self._tick_reports = None
+        self._watchdog = {'tick_timeout'   : tick_timeout,
+                          'on_tick_timeout': on_tick_timeout,
+                          'tick_reports'   : self._tick_reports}
+
+        if metrics is True:
+            metrics = TickMetrics()
+        elif metrics is False:
+            metrics = None
+        self.metrics = metrics
+        self._overhead = LoopOverhead()
+        self._instrumented = None
+        self._t_start = None
+        self._restarts = 0
+        self._supervisor_thread = None
+        self._supervisor_stop = None
+
         self._monitor_thread = None
+        self._writer_thread = None
+        self._stdout_buffer = None
+        self._dropped_frames = 0
         self.pipe_handler = PipeHandler()
         self.raise_error = raise_error
 
@@ -251,6 +643,12 @@ class Loop(object):
         self.stop()
         
 
+    def _writer_blocked(self):
+        """
+            True if the writer thread is still busy with the pipe handler after stop
+        """
+        return (self._writer_thread is not None) and self._writer_thread.is_alive()
+
     def __cleanup(self):
         """
         Wait at most twice as long as the given repetition interval
@@ -280,40 +678,126 @@ class Loop(object):
         except OSError:
             pass
         log.debug("wait for monitor thread to join")
-        self._monitor_thread.join()      
+        self._monitor_thread.join(max(2*self.interval, _JOIN_TIMEOUT_MIN))
+        if self._monitor_thread.is_alive():
+            # the pipe is still open elsewhere, e.g. inherited by a process the loop function started
+            log.warning("the output pipe of the loop process was not closed, stop receiving")
+            self._stdout_buffer.close()
+        log.debug("wait for writer thread to join")
+        self._writer_thread.join(max(2*self.interval, _JOIN_TIMEOUT_MIN))
+        if self._writer_thread.is_alive():
+            log.warning("writing the output of the loop process is blocked, stop waiting")
+        self._dropped_frames += self._stdout_buffer.dropped
+        self._stdout_buffer = None
 
     @staticmethod
-    def _wrapper_func(func, args, shared_mem_run, shared_mem_pause, interval, log_queue, sigint, sigterm, name, logging_level, conn_send):
+    def _wrapper_func(func, args, shared_mem_run, shared_mem_pause, interval, sigint, sigterm, name, logging_level, conn_send,
+                      cpu_affinity=None, nice=None, sched_idle=False, parent_pid=None,
+                      tick_timeout=None, on_tick_timeout='report', tick_reports=None, metrics=None,
+                      overhead=None, instrumented=None):
         """
             to be executed as a separate process (that's why this functions is declared static)
+
+            if parent_pid is given, the loop stops as soon as the parent process has died
+            (the process got reparented)
+
+            if tick_timeout is given, each call of func is watched by a _TickWatchdog
+
+            if metrics (TickMetrics) is given, the stages of each tick are timed
+
+            if overhead (LoopOverhead) is given, it is updated after each call of func, the
+            locks of the objects in instrumented are counted (see LoopOverhead.instrument)
+
+            the log records of this process are forwarded to the parent (see _LogBatchHandler)
+            and emitted there by the handlers of the parent between two frames, the handlers
+            inherited from the parent are removed
         """
         prefix = get_identifier(name)+' '
         global log
         log = logging.getLogger(__name__+'.'+"log_{}".format(get_identifier(name, bold=False)))
         log.setLevel(logging_level)
 
-        # try:
-        #     log.addHandler(QueueHandler(log_queue))
-        # except NameError:
-        #     log.addHandler(def_handl)
-            
-        sys.stdout = StdoutPipe(conn_send)
+        if metrics is None:
+            sys.stdout = StdoutPipe(conn_send)
+        else:
+            sys.stdout = _TimedStdoutPipe(conn_send, metrics)
+        log_handler = _LogBatchHandler(conn_send)
+        # the records are emitted by the handlers of the parent, a handler inherited
+        # by the child would emit them a second time, a logger which does not
+        # propagate its records to the root logger forwards them itself
+        loggers = [logging.getLogger()] + list(logging.Logger.manager.loggerDict.values())
+        for l in loggers:
+            if isinstance(l, logging.Logger):   # skip the placeholders
+                for h in l.handlers[:]:
+                    l.removeHandler(h)
+                if not l.propagate:
+                    l.addHandler(log_handler)
+        logging.getLogger().addHandler(log_handler)
                   
         log.debug("enter wrapper_func")            
 
         SIG_handler_Loop(sigint, sigterm, log, prefix)
+        set_scheduling(cpu_affinity, nice, sched_idle)
+        if (overhead is not None) and (instrumented is not None):
+            overhead.instrument(instrumented)
+        if tick_timeout is not None:
+            watchdog = _TickWatchdog(tick_timeout, on_tick_timeout, tick_reports)
+        else:
+            watchdog = None
+
+        try:
+            Loop._loop(func, args, shared_mem_run, shared_mem_pause, interval, parent_pid,
+                       watchdog, on_tick_timeout, log_handler, metrics, overhead)
+            log.debug("wrapper_func terminates gracefully")
+        finally:
+            log_handler.flush()
+            if overhead is not None:
+                overhead.update(sys.stdout, log_handler)
 
+    @staticmethod
+    def _loop(func, args, shared_mem_run, shared_mem_pause, interval, parent_pid,
+              watchdog, on_tick_timeout, log_handler, metrics, overhead):
+        """
+            the loop of _wrapper_func, sends the log records collected by log_handler
+            after each call of func
+        """
+        t_planned = None
         while shared_mem_run.value:
+            if (parent_pid is not None) and (os.getppid() != parent_pid):
+                log.warning("parent process (pid %s) has died, stop loop", parent_pid)
+                break
             try:
                 # in pause mode, simply sleep 
                 if shared_mem_pause.value:
                     quit_loop = False
+                    t_planned = None
                 else:
                     # if not pause mode -> call func and see what happens
                     try:
-                        quit_loop = func(*args)
+                        if watchdog is not None:
+                            watchdog.arm()
+                        if metrics is not None:
+                            t_start = metrics.clock()
+                            if t_planned is not None:
+                                metrics.add('jitter', t_start - t_planned)
+                        try:
+                            quit_loop = func(*args)
+                        finally:
+                            if watchdog is not None:
+                                watchdog.disarm()
+                            if metrics is not None:
+                                t_planned = metrics.clock()
+                                metrics.add('tick', t_planned - t_start)
+                                metrics.commit()
+                                t_planned += interval
                     except LoopInterruptError:
                         raise
+                    except LoopTickTimeoutError as e:
+                        if on_tick_timeout != 'abandon':
+                            log.error("%s, exit loop process", e)
+                            sys.exit(-1)
+                        log.warning("%s, call abandoned", e)
+                        quit_loop = False
                     except Exception as e:
                         log.error("error %s occurred in loop alling 'func(*args)'", type(e))
                         log.info("show traceback.print_exc()\n%s", traceback.format_exc())
@@ -322,21 +806,107 @@ class Loop(object):
                     if quit_loop is True:
                         log.debug("loop stooped because func returned True")
                         break
-                    
-                time.sleep(interval)
+
+                log_handler.flush()
+                if overhead is not None:
+                    overhead.update(sys.stdout, log_handler)
+                _CLOCK.sleep(interval)
             except LoopInterruptError:
                 log.debug("quit wrapper_func due to InterruptedError")
                 break
-
-        log.debug("wrapper_func terminates gracefully")
         
-    def _monitor_stdout_pipe(self):
+    def _monitor_stdout_pipe(self, conn_recv, stdout_buffer):
+        """
+            receive the output of the loop process, this never blocks on writing
+            so the pipe can not fill up (see LatestFrameBuffer)
+        """
         while True:
             try:
-                b = self.conn_recv.recv()
-                self.pipe_handler(b)
+                b = conn_recv.recv()
             except EOFError:
                 break
+            if isinstance(b, list):
+                # a batch of log records (see _LogBatchHandler)
+                for record in b:
+                    stdout_buffer.put_message(record)
+            else:
+                stdout_buffer.put(b)
+        stdout_buffer.close()
+
+    def _write_stdout(self, stdout_buffer):
+        """
+            pass the output of the loop process to the pipe handler
+
+            Messages (see write) are written only between two frames, i.e. when the
+            cursor is at the first line of the bars. They overwrite the bars which
+            are immediately redrawn using the last frame below the messages.
+        """
+        last_frame = None
+        cur_frame = ""
+        messages = []
+        while True:
+            b = stdout_buffer.get()
+            if b is None:
+                break
+            if b:
+                self._overhead.terminal_bytes += len(b)
+                if self.metrics is None:
+                    self.pipe_handler(b)
+                else:
+                    t0 = self.metrics.clock()
+                    self.pipe_handler(b)
+                    self.metrics.record('write', self.metrics.clock() - t0)
+                parts = (cur_frame + b).split(ESC_MY_MAGIC_ENDING)
+                if len(parts) > 1:
+                    last_frame = parts[-2] + ESC_MY_MAGIC_ENDING
+                    cur_frame = parts[-1]
+                elif last_frame is not None:
+                    cur_frame += b
+                else:
+                    cur_frame = "" if b.endswith('\n') else b
+
+            messages += stdout_buffer.get_messages()
+            if messages and not cur_frame:
+                self._write_messages(messages, last_frame)
+                messages = []
+
+        messages += stdout_buffer.get_messages()
+        if messages:
+            self._write_messages(messages, last_frame)
+        _flush_pipe_handler(self.pipe_handler)
+
+    def _write_messages(self, messages, last_frame):
+        erased = False
+        for msg in messages:
+            if isinstance(msg, logging.LogRecord):
+                # the handlers write to their own streams, so clear the bars first
+                # (custom pipe handlers may not know how to)
+                erase = getattr(self.pipe_handler, 'erase', None)
+                if (last_frame is not None) and (erase is not None) and not erased:
+                    erase()
+                    erased = True
+                logging.getLogger(msg.name).handle(msg)
+            else:
+                _write_pipe_message(self.pipe_handler, msg, erase = last_frame is not None)
+        if last_frame is not None:
+            self.pipe_handler(last_frame)
+        _flush_pipe_handler(self.pipe_handler)
+
+    def write(self, msg):
+        """
+            show msg above the output of the loop process, e.g. above the progress bars
+
+            While the loop is running, a plain print to stdout interferes with the
+            redrawing of the bars. A message passed to write is instead written between
+            two frames and the bars are redrawn below it. If the loop is not running
+            the message is printed.
+        """
+        msg = msg.rstrip('\n')
+        stdout_buffer = self._stdout_buffer
+        if stdout_buffer is None:
+            print(msg)
+        else:
+            stdout_buffer.put_message(msg)
 
 
         
@@ -351,28 +921,127 @@ class Loop(object):
             
         self.run = True
 
-        # try:
-        #     log_queue = mp.Queue(-1)
-        #     listener = QueueListener(log_queue, def_handl)
-        #     listener.start()
-        # except NameError:
-        #     log.error("QueueListener not available in this python version (need at least 3.2)\n"
-        #               "this may resault in incoheerent logging")
-        #     log_queue = None
-        log_queue = None
-        name = self.__class__.__name__
-        
         self.conn_recv, self.conn_send = mp.Pipe(False)
-        self._monitor_thread = threading.Thread(target = self._monitor_stdout_pipe)
+        self._stdout_buffer = LatestFrameBuffer()
+        self._monitor_thread = threading.Thread(target = self._monitor_stdout_pipe,
+                                                args   = (self.conn_recv, self._stdout_buffer))
         self._monitor_thread.daemon=True
         self._monitor_thread.start()
-        log.debug("started monitor thread")
-        
+        self._writer_thread = threading.Thread(target = self._write_stdout,
+                                               args   = (self._stdout_buffer, ))
+        self._writer_thread.daemon=True
+        self._writer_thread.start()
+        log.debug("started monitor and writer thread")
+
+        self._t_start = time.time()
+        self._start_proc()
+        _LOOP_REGISTRY.add(self)
+
+        self._restarts = 0
+        if self._max_restarts > 0:
+            self._supervisor_stop = threading.Event()
+            self._supervisor_thread = threading.Thread(target = self._supervise)
+            self._supervisor_thread.daemon = True
+            self._supervisor_thread.start()
+            log.debug("started supervisor thread")
+
+    def _start_proc(self):
+        name = self.__class__.__name__
         self._proc = mp.Process(target = Loop._wrapper_func, 
                                 args   = (self.func, self.args, self._run, self._pause, self.interval, 
-                                          log_queue, self._sigint, self._sigterm, name, log.level, self.conn_send))
+                                          self._sigint, self._sigterm, name, log.level, self.conn_send),
+                                kwargs = dict(self._sched, parent_pid = os.getpid(), metrics = self.metrics,
+                                              overhead = self._overhead, instrumented = self._instrumented,
+                                              **self._watchdog))
         self._proc.start()
         log.debug("started a new process with pid %s", self._proc.pid)
+
+    def _supervise(self):
+        """
+            restart the loop process after a crash, runs as thread in the parent process
+
+            A process which exits with exitcode 0 (func returned True, the loop was
+            interrupted by a signal) has finished regularly and is not restarted.
+        """
+        delay = self._restart_backoff
+        t_start = time.time()
+        while not self._supervisor_stop.is_set():
+            proc = self._proc
+            # not the interval of the loop, which may be 0
+            if mp_connection_wait is not None:
+                mp_connection_wait([proc.sentinel], _SUPERVISE_TIMEOUT)
+            else:
+                proc.join(_SUPERVISE_TIMEOUT)
+            if proc.is_alive():
+                continue
+            if (not self.run) or (proc.exitcode == 0):
+                return
+            if self._restarts >= self._max_restarts:
+                log.error("loop process (pid %s) crashed with exitcode %s, no restarts left",
+                          proc.pid, proc.exitcode)
+                return
+            if time.time() - t_start > _RESTART_BACKOFF_MAX:
+                delay = self._restart_backoff
+            log.warning("loop process (pid %s) crashed with exitcode %s, restart in %ss",
+                        proc.pid, proc.exitcode, delay)
+            if self._supervisor_stop.wait(delay):
+                return
+            for a in self.args:
+                if isinstance(a, LoopChannel):
+                    a._renew()
+            self._on_restart()
+            self._restarts += 1
+            self._start_proc()
+            t_start = time.time()
+            delay = min(2*delay, _RESTART_BACKOFF_MAX)
+
+    def _stop_supervisor(self):
+        if self._supervisor_thread is not None:
+            self._supervisor_stop.set()
+            self._supervisor_thread.join()
+            self._supervisor_thread = None
+
+    def _on_restart(self):
+        """
+            called before the loop process is restarted after a crash
+        """
+        pass
+
+    def overhead(self):
+        """
+            dict with the resource usage of the loop itself (see LoopOverhead) and
+                wall_time - seconds since start
+                cpu_fraction - cpu_time / wall_time, the fraction of a CPU core used
+        """
+        d = self._overhead.as_dict()
+        if self._t_start is None:
+            d['wall_time'] = 0
+            d['cpu_fraction'] = 0
+        else:
+            d['wall_time'] = time.time() - self._t_start
+            d['cpu_fraction'] = d['cpu_time'] / d['wall_time'] if d['wall_time'] > 0 else 0
+        return d
+
+    def get_tick_reports(self):
+        """
+            list of TickReport for the calls of func which overran tick_timeout,
+            received since the last call of get_tick_reports
+        """
+        reports = []
+        if self._tick_reports is None:
+            return reports
+        while True:
+            try:
+                reports.append(self._tick_reports.get_nowait())
+            except QueueEmpty:
+                return reports
+
+    @property
+    def restarts(self):
+        """
+            number of times the loop process has been restarted since start (see max_restarts)
+        """
+        return self._restarts
         
     def stop(self):
         """
@@ -382,6 +1051,8 @@ class Loop(object):
         the loop from repeating. Call __cleanup to make sure the process
         stopped. After that we could trigger start() again.
         """
+        _LOOP_REGISTRY.discard(self)
+        self._stop_supervisor()
         if self.is_alive():
             self._proc.terminate()
             
@@ -418,6 +1089,16 @@ class Loop(object):
             self._pause.value = False
             log.debug("process with pid %s resumed", self._proc.pid)
 
+    @property
+    def dropped_frames(self):
+        """
+            number of frames which were not shown because writing the output
+            of the loop process was too slow (see LatestFrameBuffer)
+        """
+        if self._stdout_buffer is None:
+            return self._dropped_frames
+        return self._dropped_frames + self._stdout_buffer.dropped
+
     def getpid(self):
         if self._proc is not None:
             return self._proc.pid
@@ -438,56 +1119,536 @@ class Loop(object):
         self._run.value = run
 
 
+class LoopChannel(object):
+    """
+    two way channel between the parent and the loop process of a Loop
 
-class Progress(Loop):
+    results: the loop process streams records of numbers to the parent through a
+    ring buffer in shared memory (no pickling, no locks, see send and recv). If the
+    parent does not read in time, the oldest records are overwritten (see lost).
+
+    config: the parent pushes updates of a dict of settings (see set_config), the
+    loop process picks them up with get_config, which only reads a shared counter
+    as long as nothing has changed.
+
+    Create the channel before the loop is started and pass it in args (as
+    direct argument, so its queue is renewed when a crashed loop process is
+    restarted, see Loop max_restarts):
+
+        def f(channel):
+            lr = channel.get_config()['lr']
+            ...
+            channel.send(step, loss)
+
+        channel = LoopChannel(fields=('step', 'loss'), config={'lr': 0.1})
+        with Loop(func=f, args=(channel,)) as loop:
+            loop.start()
+            ...
+            channel.set_config(lr=0.01)
+            for r in channel.recv():
+                print(r.step, r.loss)
     """
-    Abstract Progress Loop
-    
-    Uses Loop class to implement a repeating function to display the progress
-    of multiples processes.
-    
-    In the simplest case, given only a list of shared memory values 'count' (NOTE: 
-    a single value will be automatically mapped to a one element list),
-    the total elapses time (TET) and a speed estimation are calculated for
-    each process and passed to the display function show_stat.
-    
-    This functions needs to be implemented in a subclass. It is intended to show
-    the progress of ONE process in one line.
-    
-    When max_count is given (in general as list of shared memory values, a single
-    shared memory value will be mapped to a one element list) the time to go TTG
-    will also be calculated and passed tow show_stat.
-    
-    Information about the terminal width will be retrieved when setting width='auto'.
-    If supported by the terminal emulator the width in characters of the terminal
-    emulator will be stored in width and also passed to show_stat. 
-    Otherwise, a default width of 80 characters will be chosen.
-    
-    Also you can specify a fixed width by setting width to the desired number.
-    
-    NOTE: in order to achieve multiline progress special escape sequences are used
-    which may not be supported by all terminal emulators.
-    
-    example:
+    def __init__(self, fields, size=1024, typecode='d', config=None):
+        """
+        fields [sequence of str] - names of the values of a record, recv returns
+        namedtuples with these fields
 
-        c1 = UnsignedIntValue(val=0)
-        c2 = UnsignedIntValue(val=0)
+        size [int] - number of records the ring buffer holds
+
+        typecode [str] - type of the values (see multiprocessing.Array)
+
+        config [None, dict] - initial settings
+        """
+        self.Record = namedtuple('Record', fields)
+        self.width = len(self.Record._fields)
+        self.size = size
+        self._values = mp.Array(typecode, size*self.width, lock=False)
+        self._n = mp.Value('L', 0, lock=False)
+        self._read = 0
+        self.lost = 0
+
+        self._config = dict(config or {})
+        self._config_queue = mp.Queue()
+        self._generation = mp.Value('L', 0)
+        self._seen = 0
+
+    def send(self, *values):
+        """
+            write a record to the ring buffer (loop process)
+        """
+        n = self._n.value
+        k = (n % self.size)*self.width
+        self._values[k:k+self.width] = values
+        self._n.value = n + 1
+
+    def recv(self):
+        """
+            list of the records sent since the last call of recv (parent process)
+
+            Records overwritten before they could be read are counted in lost.
+        """
+        n = self._n.value
+        first = max(self._read, n - self.size)
+        records = []
+        for i in range(first, n):
+            k = (i % self.size)*self.width
+            records.append(self.Record(*self._values[k:k+self.width]))
+
+        # the records written meanwhile may have overwritten the first ones we read
+        cut = max(self._n.value - self.size + 1 - first, 0)
+        if cut > 0:
+            records = records[cut:]
+        self.lost += n - self._read - len(records)
+        self._read = n
+        return records
+
+    def set_config(self, **kwargs):
+        """
+            update the settings (parent process)
+        """
+        with self._generation.get_lock():
+            generation = self._generation.value + 1
+            self._config_queue.put((generation, kwargs))
+            self._generation.value = generation
+            # a loop process started from now on inherits the current settings
+            self._config.update(kwargs)
+            self._seen = generation
+
+    def get_config(self):
+        """
+            the current settings (loop process)
+
+            If an update does not arrive within _CHANNEL_CONFIG_TIMEOUT, the settings
+            known so far are returned and the update is picked up by a later call.
+        """
+        generation = self._generation.value
+        while self._seen < generation:
+            try:
+                seen, kwargs = self._config_queue.get(timeout=_CHANNEL_CONFIG_TIMEOUT)
+            except QueueEmpty:
+                log.warning("update of the settings (generation %s) not received within %ss",
+                            generation, _CHANNEL_CONFIG_TIMEOUT)
+                break
+            if seen > self._seen:
+                self._config.update(kwargs)
+                self._seen = seen
+        return self._config
+
+    def _renew(self):
+        """
+            use a new queue for the updates (parent process, see Loop._supervise)
+
+            A crashed loop process may have died while reading from the queue. The
+            restarted process inherits the current settings, so pending updates
+            are not needed.
+        """
+        with self._generation.get_lock():
+            self._config_queue = mp.Queue()
+
+
+class TaskStats(namedtuple('TaskStats', ['calls', 'errors', 'total_time', 'max_time', 'last_error'])):
+    """
+        timing statistics of a task of a LoopScheduler
+
+        calls - number of calls
+        errors - number of calls which raised an exception
+        total_time, max_time - total and maximum duration of the calls in seconds
+        last_error - string of the last exception raised (None if there was none)
+    """
+    __slots__ = ()
+
+# maximum time (in seconds) LoopChannel.get_config waits for an update of the settings
+_CHANNEL_CONFIG_TIMEOUT = 1
+
+# the loop process of a LoopScheduler wakes up at least this often (in seconds) to
+# check whether it should stop, even if no task is due
+_SCHEDULER_MAX_WAIT = 1
+
+class _TaskHeap(object):
+    """
+        the tasks of a LoopScheduler and their timing statistics
+
+        The timer heap is built in the loop process on first use. Removed tasks
+        stay on the heap and are skipped when they come up. The due times are
+        monotonic, so changes of the system time do not stall or bunch the tasks.
+    """
+    def __init__(self):
+        self.tasks = {}   # name -> (func, args, interval, seq)
+        self.stats = {}   # name -> TaskStats
+        self._heap = None
+        self._seq = 0
+
+    def add(self, name, func, args, interval):
+        self._seq += 1
+        self.tasks[name] = (func, args, interval, self._seq)
+        self.stats[name] = TaskStats(0, 0, 0., 0., None)
+        if self._heap is not None:
+            heapq.heappush(self._heap, (_monotonic(), self._seq, name))
+
+    def remove(self, name):
+        self.tasks.pop(name, None)
+        self.stats.pop(name, None)
+
+    def run_due(self):
+        """
+            run all tasks which are due, return the time the next task is due
+            (None if there are no tasks)
+        """
+        if self._heap is None:
+            now = _monotonic()
+            self._heap = [(now, seq, name) for name, (func, args, interval, seq) in self.tasks.items()]
+            heapq.heapify(self._heap)
+
+        while self._heap:
+            due, seq, name = self._heap[0]
+            task = self.tasks.get(name)
+            if (task is None) or (task[3] != seq):
+                heapq.heappop(self._heap)
+                continue
+            if due > _monotonic():
+                return due
+            heapq.heappop(self._heap)
+
+            func, args, interval, seq = task
+            quit_task = False
+            error = None
+            t0 = _monotonic()
+            try:
+                quit_task = func(*args)
+            except (LoopInterruptError, LoopTickTimeoutError):
+                raise
+            except Exception as e:
+                error = "{}: {}".format(type(e).__name__, e)
+                log.error("error %s occurred in task %s", type(e), name)
+                log.info("show traceback.print_exc()\n%s", traceback.format_exc())
+            t1 = _monotonic()
+
+            dt = t1 - t0
+            s = self.stats[name]
+            self.stats[name] = TaskStats(calls      = s.calls + 1,
+                                         errors     = s.errors + (error is not None),
+                                         total_time = s.total_time + dt,
+                                         max_time   = max(s.max_time, dt),
+                                         last_error = error if error is not None else s.last_error)
+            if quit_task is True:
+                log.debug("task %s removed because it returned True", name)
+                self.remove(name)
+                continue
+
+            # keep the phase of the task, ticks which were missed are skipped
+            due += interval
+            if due < t1:
+                due += interval*math.ceil((t1 - due) / interval)
+            heapq.heappush(self._heap, (due, seq, name))
+        return None
+
+class LoopScheduler(Loop):
+    """
+    run many tasks with independent intervals in a single loop process
+
+    The tasks are kept on a timer heap in the loop process. Each call of the loop
+    function runs the tasks which are due and then waits for the next one or for
+    a command of the parent process (add_task, remove_task, get_task_stats).
+
+    An exception raised by a task is logged and counted in its statistics (see
+    get_task_stats), the task stays scheduled. A task returning True is removed.
+    The parent learns about such a removal with the next get_task_stats, a loop
+    process restarted before (see max_restarts) runs the task again.
     
-        c = [c1, c2]
-        prepend = ['c1: ', 'c2: ']
-        with ProgressCounter(count=c, prepend=prepend) as sc:
-            sc.start()
-            while True:
-                i = np.random.randint(0,2)
-                with c[i].get_lock():
-                    c[i].value += 1
-                    
-                if c[0].value == 1000:
-                    break
-                
-                time.sleep(0.01)
+        with LoopScheduler() as s:
+            s.add_task('heartbeat', heartbeat, interval=1)
+            s.add_task('flush', flush_metrics, args=(metrics,), interval=10)
+            s.start()
+            ...
     
-    using start() within the 'with' statement ensures that the subprocess
+    Tasks added before start are inherited by the loop process. Tasks added while
+    the loop process is running are sent to it through a queue, so func and args
+    need to be picklable (e.g. no shared memory values).
+    """
+    def __init__(self, resolution=0.01, **kwargs):
+        """
+        resolution [pos number] - time the loop process sleeps between two calls of
+        the loop function, tasks may run up to that time late
+
+        kwargs - passed to Loop (except func, args and interval)
+        """
+        self._task_heap = _TaskHeap()
+        self._commands = mp.Queue()
+        self._replies = mp.Queue()
+        self._request_id = 0
+        self._task_stats = {}
+        self._resolution = resolution
+        Loop.__init__(self,
+                      func     = LoopScheduler._run_tasks,
+                      args     = (self._task_heap, self._commands, self._replies, resolution),
+                      interval = resolution,
+                      **kwargs)
+
+    def _on_restart(self):
+        # the crashed process may have died while reading from a queue
+        self._commands = mp.Queue()
+        self._replies = mp.Queue()
+        self.args = (self._task_heap, self._commands, self._replies, self._resolution)
+
+    @staticmethod
+    def _run_tasks(task_heap, commands, replies, resolution):
+        """
+            the loop function, runs in the loop process
+        """
+        next_due = task_heap.run_due()
+        if next_due is None:
+            timeout = _SCHEDULER_MAX_WAIT
+        else:
+            timeout = min(max(next_due - _monotonic() - resolution, 0), _SCHEDULER_MAX_WAIT)
+
+        try:
+            cmd = commands.get(timeout=timeout)
+        except QueueEmpty:
+            return
+        while True:
+            if cmd[0] == 'add':
+                task_heap.add(*cmd[1:])
+            elif cmd[0] == 'remove':
+                task_heap.remove(cmd[1])
+            elif cmd[0] == 'stats':
+                replies.put((cmd[1], dict(task_heap.stats)))
+            try:
+                cmd = commands.get_nowait()
+            except QueueEmpty:
+                return
+
+    def add_task(self, name, func, args=(), interval=1):
+        """
+            add a task (replaces a task with the same name), the task is first called
+            immediately and then every interval seconds
+
+            func [callable] - the task, called with args
+        """
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        if self.is_alive():
+            # fail here and not in the feeder thread of the queue
+            pickle.dumps((func, args))
+            self._commands.put(('add', name, func, args, interval))
+        # also keep track of the tasks in the parent, they are inherited by a new loop process
+        self._task_heap.add(name, func, args, interval)
+
+    def remove_task(self, name):
+        if self.is_alive():
+            self._commands.put(('remove', name))
+        self._task_heap.remove(name)
+
+    def get_task_stats(self, timeout=1):
+        """
+            dict mapping the name of each task to its TaskStats
+
+            The statistics are requested from the loop process. If it is not running
+            (or does not reply within timeout) the statistics last received are returned.
+
+            Tasks removed by the loop process (the task returned True) are removed from
+            the tasks kept by the parent as well, so a restarted loop process does not
+            run them again.
+        """
+        if not self.is_alive():
+            return self._task_stats
+        self._request_id += 1
+        self._commands.put(('stats', self._request_id))
+        t_end = _monotonic() + timeout
+        while True:
+            try:
+                request_id, stats = self._replies.get(timeout=max(t_end - _monotonic(), 0))
+            except QueueEmpty:
+                log.warning("no statistics received from the loop process within %ss", timeout)
+                return self._task_stats
+            if request_id == self._request_id:
+                # the commands are handled in order, so all tasks added so far are known
+                for name in list(self._task_heap.tasks):
+                    if name not in stats:
+                        self._task_heap.remove(name)
+                self._task_stats = stats
+                return stats
+
+
+class StatSnapshot(namedtuple('StatSnapshot', ['count_value', 'max_count_value', 'prepend', 'speed', 'tet', 'ttg',
+                                                'eta', 'counter_count', 'counter_speed', 'counter_tet',
+                                                'speed_history'])):
+    """
+        immutable statistics of a single process as passed to the render functions
+        of the progress classes (e.g. ProgressBar.render)
+
+        count_value, max_count_value, prepend, speed, tet, ttg - see Progress.show_stat
+        eta - time of arrival as timestamp (None if ttg is None)
+        counter_count, counter_speed, counter_tet - reset statistics, see ProgressBarCounter
+        speed_history - tuple of the recent speeds (oldest first), see SpeedHistory
+    """
+    __slots__ = ()
+
+StatSnapshot.__new__.__defaults__ = (None, None, None, None, None)
+
+class SpeedHistory(object):
+    """
+        ring buffer of the most recent speeds of one process
+
+        The values are kept in shared memory of fixed size, written by the loop process
+        only and readable by the parent (e.g. for the final output on stop).
+    """
+    def __init__(self, size=32):
+        self.size = size
+        self._values = mp.Array('d', size, lock=False)
+        self._n = mp.Value('L', 0, lock=False)
+
+    def append(self, speed):
+        n = self._n.value
+        self._values[n % self.size] = speed
+        self._n.value = n + 1
+
+    def values(self):
+        """
+            the stored speeds as tuple, oldest first
+        """
+        n = self._n.value
+        if n <= self.size:
+            return tuple(self._values[:n])
+        i = n % self.size
+        return tuple(self._values[i:]) + tuple(self._values[:i])
+
+SPARK_GLYPHS = u"\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588"
+
+def sparkline(values, width):
+    """
+        the last width values as sparkline, scaled from zero to their maximum
+    """
+    values = values[-width:]
+    if not values:
+        return u""
+    m = max(values)
+    if m <= 0:
+        return SPARK_GLYPHS[0] * len(values)
+    n = len(SPARK_GLYPHS) - 1
+    return u"".join(SPARK_GLYPHS[int(round(max(v, 0) / m * n))] for v in values)
+
+def render_info_line(s, width):
+    """
+        the lines of the info line s, each padded/cut to width
+    """
+    return ["{0:<{1}}".format(si[:width], width) for si in s.split('\n')]
+
+def render_frame(render, snapshots, width, theme, info_line=None, move_up=True):
+    """
+        the full output of one progress update as string
+
+        render [callable] - render function of a progress class, e.g. ProgressBar.render
+
+        snapshots [list of StatSnapshot] - the statistics for each process
+
+        width [int] - the width in characters
+
+        theme [dict] - color theme, see color_themes
+
+        info_line [str] - text shown below the bars
+
+        move_up [bool] - move the cursor back to the first line at the end
+
+        Since the output depends on the arguments only, it can be used for any kind of
+        output (terminal, html, file) and the result may be cached.
+    """
+    lines = [render(snapshot, width, theme) for snapshot in snapshots]
+    if info_line is not None:
+        lines += render_info_line(info_line, width)
+    return join_frame(lines, move_up)
+
+def join_frame(lines, move_up=True):
+    """
+        the output of one progress update made of lines (strings without newline),
+        with the cursor movement back to the first line (if move_up) and the frame end
+        marker (see render_frame)
+    """
+    n = len(lines) if move_up else 0
+                                    # this is only a hack to find the end
+                                    # of the message in a stream
+                                    # so ESC_HIDDEN+ESC_NO_CHAR_ATTR is a magic ending
+    return "".join(l + '\n' for l in lines) + ESC_MOVE_LINE_UP(n) + ESC_MY_MAGIC_ENDING
+
+class _PrintedStatLine(object):
+    """
+        turns a show_stat function which prints its line (e.g. of a subclass which
+        only implements show_stat) into a stat_line function returning the line
+    """
+    def __init__(self, show_stat):
+        self.show_stat = show_stat
+
+    def __call__(self, *args, **kwargs):
+        myout = inMemoryBuffer()
+        stdout = sys.stdout
+        sys.stdout = myout
+        try:
+            self.show_stat(*args, **kwargs)
+        finally:
+            sys.stdout = stdout
+        s = myout.getvalue()
+        return s[:-1] if s.endswith('\n') else s
+
+def stat_line_function(cls):
+    """
+        the function returning the line of a single process for the progress class cls,
+        cls.stat_line unless a subclass re implements only show_stat
+    """
+    mro = cls.__mro__
+    def defined_in(name):
+        return mro.index(next(k for k in mro if name in vars(k)))
+    if defined_in('show_stat') < defined_in('stat_line'):
+        return _PrintedStatLine(cls.show_stat)
+    return cls.stat_line
+
+class Progress(Loop):
+    """
+    Abstract Progress Loop
+    
+    Uses Loop class to implement a repeating function to display the progress
+    of multiples processes.
+    
+    In the simplest case, given only a list of shared memory values 'count' (NOTE: 
+    a single value will be automatically mapped to a one element list),
+    the total elapses time (TET) and a speed estimation are calculated for
+    each process and passed to the display function show_stat.
+    
+    This functions needs to be implemented in a subclass. It is intended to show
+    the progress of ONE process in one line.
+    
+    When max_count is given (in general as list of shared memory values, a single
+    shared memory value will be mapped to a one element list) the time to go TTG
+    will also be calculated and passed tow show_stat.
+    
+    Information about the terminal width will be retrieved when setting width='auto'.
+    If supported by the terminal emulator the width in characters of the terminal
+    emulator will be stored in width and also passed to show_stat. 
+    Otherwise, a default width of 80 characters will be chosen.
+    
+    Also you can specify a fixed width by setting width to the desired number.
+    
+    NOTE: in order to achieve multiline progress special escape sequences are used
+    which may not be supported by all terminal emulators.
+    
+    example:
+
+        c1 = UnsignedIntValue(val=0)
+        c2 = UnsignedIntValue(val=0)
+    
+        c = [c1, c2]
+        prepend = ['c1: ', 'c2: ']
+        with ProgressCounter(count=c, prepend=prepend) as sc:
+            sc.start()
+            while True:
+                i = np.random.randint(0,2)
+                with c[i].get_lock():
+                    c[i].value += 1
+                    
+                if c[0].value == 1000:
+                    break
+                
+                time.sleep(0.01)
+    
+    using start() within the 'with' statement ensures that the subprocess
     which is started by start() in order to show the progress repeatedly
     will be terminated on context exit. Otherwise one has to make sure
     that at some point the stop() routine is called. When dealing with 
@@ -504,7 +1665,16 @@ class Progress(Loop):
                  verbose           = None,
                  sigint            = 'stop', 
                  sigterm           = 'stop',
-                 info_line         = None):
+                 info_line         = None,
+                 line_log          = 'auto',
+                 cpu_budget        = None,
+                 cpu_affinity      = None,
+                 nice              = None,
+                 sched_idle        = False,
+                 max_restarts      = 0,
+                 restart_backoff   = 1,
+                 metrics           = None,
+                 show_overhead     = False):
         """       
         count [mp.Value] - shared memory to hold the current state, (list or single value)
         
@@ -523,6 +1693,27 @@ class Progress(Loop):
         s = count - old_count / (time - old_time)
         
         verbose, sigint, sigterm -> see loop class  
+
+        line_log ['auto', bool, LineLog] - instead of redrawing the bars using escape sequences
+        print a plain line for each bar when its progress has changed, rate limited by
+        the LineLog instance (see LineLog). 'auto' (default) chooses line log output when
+        stdout is not a terminal (e.g. a file or a CI log), True/False forces/prevents it.
+
+        cpu_budget [None, float, RenderBudget] - fraction of a CPU core the display may use
+        (e.g. 0.02). If the frames get more expensive, the display degrades step by step
+        (see RenderBudget). None (default) disables the adaptation.
+
+        cpu_affinity, nice, sched_idle - scheduling of the loop process, see Loop
+
+        max_restarts, restart_backoff - restart the loop process after a crash, see Loop.
+        The shared counters and speeds are kept, so the display continues where it stopped.
+
+        metrics [None, bool, TickMetrics] - record the timings of the stages of each frame,
+        see TickMetrics and Loop. Set debug_line of the TickMetrics instance to show them
+        below the bars.
+
+        show_overhead [bool] - print the resource usage of the progress display itself
+        (see Loop.overhead) below the final progress printed by stop
         """
         
         if verbose is not None:
@@ -573,7 +1764,7 @@ class Progress(Loop):
             self.last_count.append(UnsignedIntValue())
             self.last_speed.append(FloatValue())
             self.lock.append(mp.Lock())
-            self.start_time.append(FloatValue(val=time.time()))
+            self.start_time.append(FloatValue(val=_CLOCK.time()))
             if prepend is None:
                 # no prepend given
                 self.prepend.append('')
@@ -594,6 +1785,22 @@ class Progress(Loop):
         self.add_args = {}
         
         self.info_line = info_line
+
+        if line_log == 'auto':
+            line_log = (PipeHandler is PipeToPrint) and not _isatty(sys.stdout)
+        if line_log is True:
+            line_log = LineLog()
+        elif line_log is False:
+            line_log = None
+        self.line_log = line_log
+
+        if (cpu_budget is not None) and not isinstance(cpu_budget, RenderBudget):
+            cpu_budget = RenderBudget(cpu_budget=cpu_budget, interval=interval)
+        self.cpu_budget = cpu_budget
+
+        if metrics is True:
+            metrics = TickMetrics()
+        self.show_overhead = show_overhead
         
         # setup loop class with func
         Loop.__init__(self,
@@ -608,18 +1815,38 @@ class Progress(Loop):
                               self.q,
                               self.last_speed,
                               self.prepend,
-                              self.__class__.show_stat,
+                              stat_line_function(self.__class__),
                               self.len,
                               self.add_args,
                               self.lock,
-                              self.info_line),
+                              self.info_line,
+                              self.line_log,
+                              self.cpu_budget,
+                              metrics),
                       interval = interval,
                       sigint   = sigint,
                       sigterm  = sigterm,
-                      auto_kill_on_last_resort = True)
+                      auto_kill_on_last_resort = True,
+                      cpu_affinity = cpu_affinity,
+                      nice         = nice,
+                      sched_idle   = sched_idle,
+                      max_restarts    = max_restarts,
+                      restart_backoff = restart_backoff,
+                      metrics         = metrics)
+        if show_overhead:
+            # the values read by show_stat, not the objects of the user (e.g. in add_args)
+            self._instrumented = [self.count, self.last_count, self.max_count, self.start_time,
+                                  self.last_speed, self.lock, self.q]
 
     def __exit__(self, *exc_args):
         self.stop()
+
+    def _on_restart(self):
+        # the crashed process may have died while holding a lock or using a queue,
+        # the speed estimation starts over with new ones
+        for i in range(self.len):
+            self.lock[i] = mp.Lock()
+            self.q[i] = myQueue()
             
         
     @staticmethod
@@ -640,7 +1867,7 @@ class Progress(Loop):
         """
         count_value = count.value
         start_time_value = start_time.value
-        current_time = time.time()
+        current_time = _CLOCK.time()
         
         if last_count.value != count_value:
             # some progress happened
@@ -701,7 +1928,7 @@ class Progress(Loop):
             self.q[i].get()
         
         self.lock[i].release()
-        self.start_time[i].value = time.time()
+        self.start_time[i].value = _CLOCK.time()
 
     def _show_stat(self):
         """
@@ -717,11 +1944,12 @@ class Progress(Loop):
                                          self.q,
                                          self.last_speed,
                                          self.prepend,
-                                         self.__class__.show_stat,
+                                         stat_line_function(self.__class__),
                                          self.len, 
                                          self.add_args,
                                          self.lock,
                                          self.info_line,
+                                         self.line_log,
                                          no_move_up=True)
 
     def reset(self, i = None):
@@ -737,6 +1965,26 @@ class Progress(Loop):
             self._reset_i(i)
 #        super(Progress, self).start()
 
+    @staticmethod
+    def snapshot(count_value, max_count_value, prepend, speed, tet, ttg, i=None, **kwargs):
+        """
+            collect the arguments passed to show_stat in a StatSnapshot, the counter
+            statistics are included if present in kwargs (see ProgressBarCounter)
+        """
+        now = _CLOCK.time()
+        eta = None if ttg is None else _CLOCK.wall() + ttg
+        speed_history = None
+        if 'speed_history' in kwargs:
+            speed_history = kwargs['speed_history'][i].values()
+        if 'counter_count' in kwargs:
+            return StatSnapshot(count_value, max_count_value, prepend, speed, tet, ttg, eta,
+                                kwargs['counter_count'][i].value,
+                                kwargs['counter_speed'][i].value,
+                                now - kwargs['init_time'],
+                                speed_history)
+        return StatSnapshot(count_value, max_count_value, prepend, speed, tet, ttg, eta,
+                            speed_history=speed_history)
+
     @staticmethod        
     def show_stat(count_value, max_count_value, prepend, speed, tet, ttg, width, **kwargs):
         """
@@ -760,6 +2008,17 @@ class Progress(Loop):
         """
         raise NotImplementedError
 
+    @staticmethod
+    def stat_line(count_value, max_count_value, prepend, speed, tet, ttg, width, **kwargs):
+        """
+            like show_stat, but return the line instead of printing it,
+            re implement this function in a subclass
+
+            The progress loop builds the whole frame from these lines and writes it
+            at once (see show_stat_wrapper_multi).
+        """
+        raise NotImplementedError
+
     @staticmethod        
     def show_stat_wrapper(count, 
                           last_count, 
@@ -770,10 +2029,16 @@ class Progress(Loop):
                           q,
                           last_speed,
                           prepend, 
-                          show_stat_function,
+                          stat_line_function,
                           add_args, 
                           i, 
-                          lock):
+                          lock,
+                          metrics = None):
+        """
+            the line of the i-th process as returned by stat_line_function
+        """
+        if metrics is not None:
+            t0 = metrics.clock()
         count_value, max_count_value, speed, tet, ttg, = Progress._calc(count, 
                                                                         last_count, 
                                                                         start_time, 
@@ -782,7 +2047,14 @@ class Progress(Loop):
                                                                         q,
                                                                         last_speed, 
                                                                         lock) 
-        return show_stat_function(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **add_args)
+        if metrics is None:
+            return stat_line_function(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **add_args)
+
+        t1 = metrics.clock()
+        metrics.add('calc', t1 - t0)
+        res = stat_line_function(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **add_args)
+        metrics.add('format', metrics.clock() - t1)
+        return res
 
     @staticmethod
     def show_stat_wrapper_multi(count, 
@@ -794,49 +2066,117 @@ class Progress(Loop):
                                 q, 
                                 last_speed,
                                 prepend, 
-                                show_stat_function, 
+                                stat_line_function, 
                                 len_, 
                                 add_args,
                                 lock,
                                 info_line,
+                                line_log=None,
+                                budget=None,
+                                metrics=None,
                                 no_move_up=False):
         """
-            call the static method show_stat_wrapper for each process
+            print the frame made of the lines of all processes (see show_stat_wrapper
+            and join_frame) at once
+
+            if line_log is given, print plain lines as decided by line_log instead,
+            no_move_up then forces a line for each process (final output)
+
+            if budget (RenderBudget) is given, the cost of the frame is measured and
+            the display degrades as decided by budget
+
+            if metrics (TickMetrics) is given, the stages calc and format are timed
         """
-#         print(ESC_BOLD, end='')
-#         sys.stdout.flush()
+        if line_log is not None:
+            Progress.show_stat_line_log(count, last_count, start_time, max_count, speed_calc_cycles,
+                                        q, last_speed, prepend, len_, lock, info_line, line_log,
+                                        force=no_move_up)
+            return
+
+        n_show = len_
+        if budget is not None:
+            if budget.skip_frame():
+                for i in range(len_):
+                    Progress._calc(count[i], last_count[i], start_time[i], max_count[i],
+                                   speed_calc_cycles, q[i], last_speed[i], lock[i])
+                return
+            t0 = budget.clock()
+            stat_line_function = budget.show_stat_function(stat_line_function)
+            n_show = budget.visible_bars(len_)
+
+        lines = [Progress.show_stat_wrapper(count[i], 
+                                            last_count[i], 
+                                            start_time[i], 
+                                            max_count[i], 
+                                            speed_calc_cycles, 
+                                            width, 
+                                            q[i],
+                                            last_speed[i],
+                                            prepend[i], 
+                                            stat_line_function, 
+                                            add_args, 
+                                            i, 
+                                            lock[i],
+                                            metrics) for i in range(n_show)]
+        if n_show < len_:
+            for i in range(n_show, len_):
+                Progress._calc(count[i], last_count[i], start_time[i], max_count[i],
+                               speed_calc_cycles, q[i], last_speed[i], lock[i])
+            lines.append(ESC_ERASE_LINE + "... {} more".format(len_ - n_show))
+        if info_line is not None:
+            if width == 'auto':
+                width = get_terminal_width()
+            lines += render_info_line(info_line.value.decode('utf-8'), width)
+
+        if (metrics is not None) and metrics.debug_line:
+            lines.append(ESC_ERASE_LINE + metrics.format_line())
+        
+        if budget is not None:
+            # erase lines left over from a previous frame with more lines
+            n = len(lines)
+            lines += [ESC_ERASE_LINE] * max(budget.last_lines - n, 0)
+            budget.last_lines = n
+
+        print(join_frame(lines, move_up=not no_move_up), end='')
+        sys.stdout.flush()
+        if budget is not None:
+            budget.update(budget.clock() - t0)
+
+    @staticmethod
+    def show_stat_line_log(count,
+                           last_count,
+                           start_time,
+                           max_count,
+                           speed_calc_cycles,
+                           q,
+                           last_speed,
+                           prepend,
+                           len_,
+                           lock,
+                           info_line,
+                           line_log,
+                           force=False):
+        """
+            line oriented output for non-interactive stdout, uses the same _calc statistics
+            as the bars but prints a line for a process only when line_log says so
+        """
+        now = _CLOCK.time()
         for i in range(len_):
-            Progress.show_stat_wrapper(count[i], 
-                                       last_count[i], 
-                                       start_time[i], 
-                                       max_count[i], 
-                                       speed_calc_cycles, 
-                                       width, 
-                                       q[i],
-                                       last_speed[i],
-                                       prepend[i], 
-                                       show_stat_function, 
-                                       add_args, 
-                                       i, 
-                                       lock[i])
-        n = len_
+            count_value, max_count_value, speed, tet, ttg = Progress._calc(count[i],
+                                                                           last_count[i],
+                                                                           start_time[i],
+                                                                           max_count[i],
+                                                                           speed_calc_cycles,
+                                                                           q[i],
+                                                                           last_speed[i],
+                                                                           lock[i])
+            if line_log.due(i, count_value, max_count_value, now, force):
+                print(LineLog.line(count_value, max_count_value, prepend[i], speed, tet, ttg))
+
         if info_line is not None:
             s = info_line.value.decode('utf-8')
-            s = s.split('\n')
-            n += len(s)
-            for si in s:
-                if width == 'auto':
-                    width = get_terminal_width()
-                if len(si) > width:
-                    si = si[:width]
-                print("{0:<{1}}".format(si, width))
-        
-        if no_move_up:
-            n = 0
-                                    # this is only a hack to find the end
-                                    # of the message in a stream
-                                    # so ESC_HIDDEN+ESC_NO_CHAR_ATTR is a magic ending
-        print(ESC_MOVE_LINE_UP(n) + ESC_MY_MAGIC_ENDING, end='')
+            if line_log.info_due(s, force):
+                print(s)
         sys.stdout.flush()
 
     def start(self):
@@ -864,17 +2204,29 @@ class Progress(Loop):
         super(Progress, self).stop()
         terminal_unreserve(progress_obj=self, verbose=self.verbose)
 
+        if self.show_on_exit and self._writer_blocked():
+            # the final output would interleave with the frame still being written
+            log.warning("the pipe handler is still busy, skip the final progress output")
+            self.show_on_exit = False
+
         if self.show_on_exit:
             if not isinstance(self.pipe_handler, PipeToPrint):
                 myout = inMemoryBuffer()
                 stdout = sys.stdout
                 sys.stdout = myout
-                self._show_stat()
+                try:
+                    self._show_stat()
+                finally:
+                    sys.stdout = stdout
                 self.pipe_handler(myout.getvalue())
-                sys.stdout = stdout
+                _flush_pipe_handler(self.pipe_handler)
             else:
                 self._show_stat()
-                print()
+                if self.line_log is None:
+                    print()
+            if self.show_overhead:
+                _write_pipe_message(self.pipe_handler, format_overhead(self.overhead()), erase=False)
+                _flush_pipe_handler(self.pipe_handler)
         self.show_on_exit = False
         
 
@@ -892,19 +2244,20 @@ class ProgressBar(Progress):
         self._PRE_PREPEND = ESC_NO_CHAR_ATTR + ESC_RED
         self._POST_PREPEND = ESC_BOLD + ESC_GREEN
 
-    @staticmethod        
-    def show_stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+    @staticmethod
+    def render(snapshot, width, theme):
+        """
+            the bar for the statistics in snapshot (see StatSnapshot) as string
+        """
+        count_value, max_count_value, prepend, speed, tet, ttg = snapshot[:6]
         if (max_count_value is None) or (max_count_value == 0):
             # only show current absolute progress as number and estimated speed
-            print("{}{}{} [{}] {}#{}    ".format(ESC_NO_CHAR_ATTR,
-                                                 COLTHM['PRE_COL'] + prepend + ESC_DEFAULT,
-                                                 humanize_time(tet), humanize_speed(speed),
-                                                 ESC_BOLD + COLTHM['BAR_COL'],
-                                                 count_value))
+            return "{}{}{} [{}] {}#{}    ".format(ESC_NO_CHAR_ATTR,
+                                                  theme['PRE_COL'] + prepend + ESC_DEFAULT,
+                                                  humanize_time(tet), humanize_speed(speed),
+                                                  ESC_BOLD + theme['BAR_COL'],
+                                                  count_value)
         else:
-            if width == 'auto':
-                width = get_terminal_width()
-            
             # deduce relative progress and show as bar on screen
             if ttg is None:
                 s3 = " TTG --"
@@ -912,7 +2265,7 @@ class ProgressBar(Progress):
                 s3 = " TTG {}".format(humanize_time(ttg))
                
             s1 = "{}{}{} [{}] ".format(ESC_NO_CHAR_ATTR,
-                                      COLTHM['PRE_COL'] + prepend + ESC_DEFAULT,
+                                      theme['PRE_COL'] + prepend + ESC_DEFAULT,
                                       humanize_time(tet),
                                       humanize_speed(speed))
             
@@ -920,9 +2273,20 @@ class ProgressBar(Progress):
             l2 = width - l - 3
             a = int(l2 * count_value / max_count_value)
             b = l2 - a
-            s2 = COLTHM['BAR_COL'] + ESC_BOLD + "[" + "="*a + ">" + " "*b + "]" + ESC_RESET_BOLD + ESC_DEFAULT
+            s2 = theme['BAR_COL'] + ESC_BOLD + "[" + _bar_body(a, b) + "]" + ESC_RESET_BOLD + ESC_DEFAULT
 
-            print(s1+s2+s3)
+            return s1+s2+s3
+
+    @staticmethod
+    def stat_line(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+        if width == 'auto':
+            width = get_terminal_width()
+        snapshot = Progress.snapshot(count_value, max_count_value, prepend, speed, tet, ttg, i, **kwargs)
+        return ProgressBar.render(snapshot, width, COLTHM)
+
+    @staticmethod
+    def show_stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+        print(ProgressBar.stat_line(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs))
 
 
 class ProgressBarCounter(Progress):
@@ -951,7 +2315,7 @@ class ProgressBarCounter(Progress):
             self.counter_speed.append(FloatValue())
         
         self.counter_speed_calc_cycles = speed_calc_cycles_counter
-        self.init_time = time.time()
+        self.init_time = _CLOCK.time()
             
         self.add_args['counter_count'] = self.counter_count
         self.add_args['counter_speed'] = self.counter_speed
@@ -968,7 +2332,7 @@ class ProgressBarCounter(Progress):
         count_value = c.value
         q = self.counter_q[i]
          
-        current_time = time.time()
+        current_time = _CLOCK.time()
         q.put((count_value, current_time))
         
         if q.qsize() > self.counter_speed_calc_cycles:
@@ -983,26 +2347,31 @@ class ProgressBarCounter(Progress):
         Progress._reset_i(self, i)
         
     @staticmethod
-    def show_stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
-        counter_count = kwargs['counter_count'][i]
-        counter_speed = kwargs['counter_speed'][i]
-        counter_tet = time.time() - kwargs['init_time']
-        
-        s_c = "{}{}{} [{}] {}#{} - ".format(ESC_NO_CHAR_ATTR,
-                                            COLTHM['PRE_COL']+prepend+ESC_DEFAULT,
-                                            humanize_time(counter_tet),
-                                            humanize_speed(counter_speed.value),
-                                            COLTHM['BAR_COL'],
-                                            str(counter_count.value) + ESC_DEFAULT)
+    def render_counter(snapshot, theme):
+        """
+            the counter statistics (the part in front of the bar) as string
+        """
+        return "{}{}{} [{}] {}#{} - ".format(ESC_NO_CHAR_ATTR,
+                                             theme['PRE_COL']+snapshot.prepend+ESC_DEFAULT,
+                                             humanize_time(snapshot.counter_tet),
+                                             humanize_speed(snapshot.counter_speed),
+                                             theme['BAR_COL'],
+                                             str(snapshot.counter_count) + ESC_DEFAULT)
+
+    @staticmethod
+    def render(snapshot, width, theme):
+        """
+            the counter statistics followed by the bar for the statistics in snapshot
+            (see StatSnapshot) as string
+        """
+        count_value, max_count_value, prepend, speed, tet, ttg = snapshot[:6]
+        s_c = ProgressBarCounter.render_counter(snapshot, theme)
 
-        if width == 'auto':
-            width = get_terminal_width()
-        
         if (max_count_value is None) or (max_count_value == 0):
             s_c = "{}{} [{}] {}#{}    ".format(s_c,
                                                humanize_time(tet),
                                                humanize_speed(speed),
-                                               COLTHM['BAR_COL'],
+                                               theme['BAR_COL'],
                                                str(count_value)+ ESC_DEFAULT)
         else:
             if ttg is None:
@@ -1017,176 +2386,873 @@ class ProgressBarCounter(Progress):
 
             a = int(l2 * count_value / max_count_value)
             b = l2 - a
-            s2 = COLTHM['BAR_COL'] + ESC_BOLD + "[" + "=" * a + ">" + " " * b + "]" + ESC_RESET_BOLD + ESC_DEFAULT
+            s2 = theme['BAR_COL'] + ESC_BOLD + "[" + _bar_body(a, b) + "]" + ESC_RESET_BOLD + ESC_DEFAULT
             s_c = s_c+s1+s2+s3
 
-        print(s_c)
+        return s_c
+
+    @staticmethod
+    def stat_line(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+        if width == 'auto':
+            width = get_terminal_width()
+        snapshot = Progress.snapshot(count_value, max_count_value, prepend, speed, tet, ttg, i, **kwargs)
+        return ProgressBarCounter.render(snapshot, width, COLTHM)
+
+    @staticmethod
+    def show_stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+        print(ProgressBarCounter.stat_line(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs))
+
+class ProgressBarFancy(Progress):
+    """
+        implements a progress bar where the color indicates the current status
+        similar to the bars known from 'htop'
+    """
+    def __init__(self, *args, **kwargs):
+        """
+            width [int/'auto'] - the number of characters used to show the Progress bar,
+            use 'auto' to determine width from terminal information -> see _set_width
+        """            
+        Progress.__init__(self, *args, **kwargs)
+        
+    @staticmethod        
+    def get_d(s1, s2, width, lp, lps):
+        d = width-len_string_without_ESC(s1)-len_string_without_ESC(s2)-2-lp-lps
+        if d >= 0:
+            d1 = d // 2
+            d2 = d - d1
+            return s1, s2, d1, d2
+
+    @staticmethod
+    def full_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
+        s1 = "TET {} {:>12} TTG {}".format(tet, speed, ttg)
+        s2 = "ETA {} ORT {}".format(eta, ort)
+        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)
+
+
+    @staticmethod
+    def full_minor_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
+        s1 = "E {} {:>12} G {}".format(tet, speed, ttg)
+        s2 = "A {} O {}".format(eta, ort)
+        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)
+
+    @staticmethod
+    def reduced_1_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
+        s1 = "E {} {:>12} G {}".format(tet, speed, ttg)
+        s2 = "O {}".format(ort)
+        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)  
+
+    @staticmethod
+    def reduced_2_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
+        s1 = "E {} G {}".format(tet, ttg)
+        s2 = "O {}".format(ort)
+        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)
+    
+    @staticmethod
+    def reduced_3_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
+        s1 = "E {} G {}".format(tet, ttg)
+        s2 = ''
+        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)
+    
+    @staticmethod
+    def reduced_4_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
+        s1 = ''
+        s2 = ''
+        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)    
+
+    # layouts sorted from most to least verbose, see _choose_layout
+    _layouts = ['full_stat', 'full_minor_stat', 'reduced_1_stat',
+                'reduced_2_stat', 'reduced_3_stat', 'reduced_4_stat']
+    _layout_cache = {}
+    _eta_cache = {}
+
+    @staticmethod
+    def _choose_layout(args):
+        """
+            return the result of the most verbose layout which fits into the given width
+
+            Which layout fits depends on the width, the length of the prepend, the length
+            of the percentage string and the lengths of the formatted stat strings only.
+            So the index of the chosen layout is cached for these lengths. Entries for
+            an old width (terminal resize) are dropped once the cache has grown too large.
+        """
+        p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps = args
+        key = (width, lp, lps, len(tet), len(speed), len(ttg), len(eta), len(ort))
+        idx = ProgressBarFancy._layout_cache.get(key)
+        if idx is not None:
+            return getattr(ProgressBarFancy, ProgressBarFancy._layouts[idx])(*args)
+
+        if len(ProgressBarFancy._layout_cache) > 1024:
+            ProgressBarFancy._layout_cache.clear()
+        res = None
+        for idx, layout in enumerate(ProgressBarFancy._layouts):
+            res = getattr(ProgressBarFancy, layout)(*args)
+            if res is not None:
+                break
+        if res is None:
+            idx = len(ProgressBarFancy._layouts) - 1
+        ProgressBarFancy._layout_cache[key] = idx
+        return res
+
+    @staticmethod
+    def _eta(eta):
+        """
+            formatted time of arrival (timestamp eta), the string is reused as long
+            as its second resolution value does not change
+        """
+        t = int(eta)
+        eta = ProgressBarFancy._eta_cache.get(t)
+        if eta is None:
+            if len(ProgressBarFancy._eta_cache) > 256:
+                ProgressBarFancy._eta_cache.clear()
+            eta = datetime.datetime.fromtimestamp(t).strftime("%Y%m%d_%H:%M:%S")
+            ProgressBarFancy._eta_cache[t] = eta
+        return eta
+
+    _kw_bold_re = {}
+
+    @staticmethod        
+    def kw_bold(s, ch_after):
+        """
+            make the keywords (TET, TTG, ETA, ORT, E, G, A, O) bold when followed by one of
+            the characters in ch_after
+
+            All keywords are replaced in a single pass using a regular expression which
+            is compiled once for each ch_after.
+        """
+        ch_after = tuple(ch_after)
+        kw_re = ProgressBarFancy._kw_bold_re.get(ch_after)
+        if kw_re is None:
+            kw_re = re.compile("(TET|TTG|ETA|ORT|E|G|A|O)(?=[{}])".format(
+                               "".join(re.escape(c) for c in ch_after)))
+            ProgressBarFancy._kw_bold_re[ch_after] = kw_re
+        return kw_re.sub(ESC_BOLD + r"\1" + ESC_RESET_BOLD, s)
+
+    @staticmethod        
+    def render(snapshot, width, theme):
+        """
+            the bar for the statistics in snapshot (see StatSnapshot) as string
+        """
+        count_value, max_count_value, prepend, speed, tet, ttg = snapshot[:6]
+        if (max_count_value is None) or (max_count_value == 0):
+            # only show current absolute progress as number and estimated speed
+            stat = "{}{} [{}] {}#{}    ".format(theme['PRE_COL']+prepend+ESC_DEFAULT,
+                                                humanize_time(tet),
+                                                humanize_speed(speed),
+                                                theme['BAR_COL'],
+                                                str(count_value) + ESC_DEFAULT)
+        else:
+            # deduce relative progress
+            p = count_value / max_count_value
+            if p < 1:
+                ps = " {:.1%} ".format(p)
+            else:
+                ps = " {:.0%} ".format(p)
+            
+            if ttg is None:
+                eta = '--'
+                ort = None
+            else:
+                eta = ProgressBarFancy._eta(snapshot.eta)
+                ort = tet + ttg
+                
+            tet = humanize_time(tet)
+            speed = '['+humanize_speed(speed)+']'
+            ttg = humanize_time(ttg)
+            ort = humanize_time(ort)
+            repl_ch = '-'
+            lp = len(prepend)
+            
+            args = p, tet, speed, ttg, eta, ort, repl_ch, width, lp, len(ps)
+            
+            res = ProgressBarFancy._choose_layout(args)
+
+            if res is not None:
+                s1, s2, d1, d2 = res                
+                s = s1 + ' '*d1 + ps + ' '*d2 + s2
+                s_before = s[:math.ceil(width*p)].replace(' ', repl_ch)
+                if (len(s_before) > 0) and (s_before[-1] == repl_ch):
+                    s_before = s_before[:-1] + '>'
+                s_after  = s[math.ceil(width*p):]
+                
+                s_before = ProgressBarFancy.kw_bold(s_before, ch_after=(repl_ch, '>'))
+                s_after = ProgressBarFancy.kw_bold(s_after, ch_after=(' ',))
+                stat = (theme['PRE_COL']+prepend+ESC_DEFAULT+
+                        theme['BAR_COL']+ESC_BOLD + '[' + ESC_RESET_BOLD + s_before + ESC_DEFAULT +
+                        s_after + ESC_BOLD + theme['BAR_COL']+']' + ESC_NO_CHAR_ATTR)
+            else:
+                ps = ps.strip()
+                if p == 1:
+                    ps = ' '+ps
+                stat = prepend + ps
+
+        return stat
+
+    @staticmethod
+    def stat_line(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+        if width == 'auto':
+            width = get_terminal_width()
+        snapshot = Progress.snapshot(count_value, max_count_value, prepend, speed, tet, ttg, i, **kwargs)
+        return ProgressBarFancy.render(snapshot, width, COLTHM)
+
+    @staticmethod
+    def show_stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+        print(ProgressBarFancy.stat_line(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs))
+
+class ProgressBarCounterFancy(ProgressBarCounter):
+    @staticmethod
+    def render(snapshot, width, theme):
+        """
+            the counter statistics followed by the fancy bar for the statistics in
+            snapshot (see StatSnapshot) as string
+        """
+        count_value, max_count_value, prepend, speed, tet, ttg = snapshot[:6]
+        s_c = ProgressBarCounter.render_counter(snapshot, theme)
+
+        if (max_count_value is None) or (max_count_value == 0):
+            s_c = "{}{} [{}] {}#{}    ".format(s_c, humanize_time(tet), humanize_speed(speed),
+                                               theme['BAR_COL'], str(count_value)+ESC_DEFAULT)
+        else:
+            _width = width - len_string_without_ESC(s_c)
+            s_c += ProgressBarFancy.render(snapshot._replace(prepend=''), _width, theme)
+
+        return s_c
+
+    @staticmethod
+    def stat_line(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+        if width == 'auto':
+            width = get_terminal_width()
+        snapshot = Progress.snapshot(count_value, max_count_value, prepend, speed, tet, ttg, i, **kwargs)
+        return ProgressBarCounterFancy.render(snapshot, width, COLTHM)
+
+    @staticmethod
+    def show_stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+        print(ProgressBarCounterFancy.stat_line(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs))
+                        
+
+class Column(object):
+    """
+        a column of a ColumnLayout
+
+        name [str] - the kind of the column, one of
+            'label'   - the prepend string
+            'count'   - the current count
+            'percent' - the relative progress
+            'bar'     - the progress as bar
+            'speed'   - the speed, see humanize_speed
+            'tet'     - total elapsed time
+            'ttg'     - time to go
+            'eta'     - estimated time of arrival
+            'spark'   - sparkline of the recent speeds (see SpeedHistory)
+        or any other name for a custom column (requires func)
+
+        width [int, None] - number of characters of the column, longer values are cut.
+        If None, a default width is used for the predefined kinds. The bar takes the
+        remaining width if None.
+
+        func [callable] - func(snapshot) -> str, the value of a custom column,
+        snapshot is a StatSnapshot
+
+        align ['<', '>', None] - left or right alignment within the column,
+        None means left for the label and right for all other columns
+
+        color [str, None] - key of the color theme (e.g. 'PRE_COL', 'BAR_COL') to color the column
+    """
+    default_width = {'label'  : None,
+                     'count'  : 8,
+                     'percent': 6,
+                     'bar'    : None,
+                     'speed'  : 11,
+                     'tet'    : 8,
+                     'ttg'    : 8,
+                     'eta'    : 17,
+                     'spark'  : 16}
+
+    default_color = {'label': 'PRE_COL',
+                     'bar'  : 'BAR_COL'}
+
+    def __init__(self, name, width=None, func=None, align=None, color=None):
+        if (name not in Column.default_width) and (func is None):
+            raise ValueError("custom column '{}' needs func".format(name))
+        self.name = name
+        self.width = width if width is not None else Column.default_width.get(name)
+        self.func = func
+        if align is None:
+            align = '<' if name == 'label' else '>'
+        self.align = align
+        self.color = color if color is not None else Column.default_color.get(name)
+
+    def value(self, snapshot):
+        """
+            the (not yet padded) string of the column for the statistics in snapshot
+        """
+        if self.func is not None:
+            return self.func(snapshot)
+        name = self.name
+        if name == 'label':
+            return snapshot.prepend
+        elif name == 'count':
+            return str(snapshot.count_value)
+        elif name == 'percent':
+            if not snapshot.max_count_value:
+                return '--'
+            return "{:.1%}".format(snapshot.count_value / snapshot.max_count_value)
+        elif name == 'speed':
+            return humanize_speed(snapshot.speed)
+        elif name == 'tet':
+            return humanize_time(snapshot.tet)
+        elif name == 'ttg':
+            return humanize_time(snapshot.ttg)
+        elif name == 'eta':
+            if snapshot.eta is None:
+                return '--'
+            return ProgressBarFancy._eta(snapshot.eta)
+        elif name == 'spark':
+            return sparkline(snapshot.speed_history or (), self.width)
+
+class ColumnLayout(object):
+    """
+        a progress display given as sequence of columns
+
+        For each width the columns are compiled once into a plan which holds the
+        width of every column (the flexible column takes what is left) and a format
+        string for the whole line. Rendering a frame then only computes the values
+        of the columns.
+
+        columns [sequence] - Column instances or names of the predefined kinds (see Column)
+
+        sep [str] - separator between the columns
+    """
+    def __init__(self, columns, sep=' '):
+        self.columns = [c if isinstance(c, Column) else Column(c) for c in columns]
+        self.sep = sep
+        self._plans = {}
+
+    def set_label_width(self, label_width):
+        """
+            set the width of label columns which have no width yet
+        """
+        for c in self.columns:
+            if (c.name == 'label') and (c.width is None):
+                c.width = label_width
+        self._plans = {}
+
+    def plan(self, width):
+        """
+            the widths of the columns and the format string of the line for the
+            given total width (cached)
+        """
+        plan = self._plans.get(width)
+        if plan is not None:
+            return plan
+
+        fixed = sum(c.width for c in self.columns if c.width is not None)
+        flexible = [c for c in self.columns if c.width is None]
+        rest = width - fixed - len(self.sep) * (len(self.columns) - 1)
+        if flexible:
+            rest = max(rest, 0)
+            w_flex = rest // len(flexible)
+
+        widths = []
+        fmt = []
+        for i, c in enumerate(self.columns):
+            w = c.width if c.width is not None else w_flex
+            widths.append(w)
+            cell = "{%d:%s%d}" % (i, c.align, w) if w > 0 else "{%d:.0}" % i
+            if c.color is not None:
+                cell = "{col_%d}" % i + cell + ESC_DEFAULT
+            fmt.append(cell)
+        plan = (widths, self.sep.join(fmt))
+
+        if len(self._plans) > 16:
+            self._plans = {}
+        self._plans[width] = plan
+        return plan
+
+    def render(self, snapshot, width, theme):
+        """
+            the line for the statistics in snapshot (see StatSnapshot) as string
+        """
+        widths, fmt = self.plan(width)
+        values = []
+        for c, w in zip(self.columns, widths):
+            if c.name == 'bar' and c.func is None:
+                values.append(_bar(snapshot.count_value, snapshot.max_count_value, w))
+            else:
+                values.append(c.value(snapshot)[:w])
+        colors = dict(("col_%d" % i, theme[c.color]) for i, c in enumerate(self.columns) if c.color is not None)
+        return ESC_NO_CHAR_ATTR + fmt.format(*values, **colors)
+
+def _bar(count_value, max_count_value, width):
+    """
+        the bar '[==>  ]' of the given width
+    """
+    if width < 3:
+        return ' ' * width
+    l = width - 3
+    if not max_count_value:
+        return "[" + " " * (l + 1) + "]"
+    a = min(int(l * count_value / max_count_value), l)
+    return "[" + _bar_body(a, l - a) + "]"
+
+class ProgressBarColumns(Progress):
+    """
+        implements a progress display whose layout is given as sequence of columns,
+        see Column and ColumnLayout
+
+        example:
+
+            columns = ['label', 'count', 'percent', 'bar', 'speed', 'ttg',
+                       Column('load', width=6, func=lambda snapshot: ...)]
+            with ProgressBarColumns(count=c, max_count=m, columns=columns) as pb:
+                pb.start()
+                ...
+    """
+    default_columns = ['label', 'tet', 'speed', 'bar', 'percent', 'ttg']
+
+    def __init__(self, *args, **kwargs):
+        """
+            columns [sequence, ColumnLayout] - the columns to show (see ColumnLayout),
+            default is ProgressBarColumns.default_columns
+
+            for all other arguments see Progress
+        """
+        columns = kwargs.pop('columns', None)
+        Progress.__init__(self, *args, **kwargs)
+        if columns is None:
+            columns = ProgressBarColumns.default_columns
+        if not isinstance(columns, ColumnLayout):
+            columns = ColumnLayout(columns)
+        columns.set_label_width(max(len_string_without_ESC(p) for p in self.prepend))
+        self.add_args['layout'] = columns
+
+        spark_width = [c.width for c in columns.columns if c.name == 'spark']
+        if spark_width:
+            self.add_args['speed_history'] = [SpeedHistory(max(spark_width)) for i in range(self.len)]
+
+    @staticmethod
+    def stat_line(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+        if width == 'auto':
+            width = get_terminal_width()
+        if 'speed_history' in kwargs:
+            kwargs['speed_history'][i].append(speed)
+        snapshot = Progress.snapshot(count_value, max_count_value, prepend, speed, tet, ttg, i, **kwargs)
+        return kwargs['layout'].render(snapshot, width, COLTHM)
+
+    @staticmethod
+    def show_stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+        print(ProgressBarColumns.stat_line(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs))
+
+class RenderBudget(object):
+    """
+        keeps the CPU time used by the progress display below a budget
+
+        The cost of each frame is measured. When it exceeds cpu_budget (fraction of a
+        CPU core) for patience frames in a row, the display degrades by one level,
+        when it is below half the budget for patience frames, it recovers by one level.
+
+        The levels are
+            0 - full display
+            1 - fancy bars are shown as plain bars
+            2 - only the first min_bars bars are shown
+            3, 4, ... - only every 2nd, 4th, ... frame is shown (at most max_frame_skip)
+    """
+    def __init__(self, cpu_budget=0.02, interval=1, min_bars=4, max_frame_skip=8, patience=3):
+        self.cpu_budget = cpu_budget
+        self.interval = max(interval, 1e-3)
+        self.min_bars = min_bars
+        self.max_level = 2 + int(math.log(max_frame_skip, 2))
+        self.patience = patience
+        self.level = 0
+        self.last_lines = 0
+        self.load = 0
+        self._over = 0
+        self._under = 0
+        self._tick = 0
+
+    @staticmethod
+    def clock():
+        try:
+            return time.process_time()
+        except AttributeError:
+            return time.clock()
+
+    @property
+    def frame_every(self):
+        return 2 ** max(self.level - 2, 0)
+
+    def skip_frame(self):
+        """
+            True if the current frame is not to be shown (level > 2)
+        """
+        self._tick += 1
+        return (self._tick % self.frame_every) != 0
+
+    def show_stat_function(self, show_stat_function):
+        """
+            the show_stat (or stat_line) function to use at the current level
+        """
+        if self.level >= 1:
+            return PLAIN_SHOW_STAT.get(show_stat_function, show_stat_function)
+        return show_stat_function
+
+    def visible_bars(self, len_):
+        """
+            the number of bars to show at the current level
+        """
+        if self.level >= 2:
+            return min(len_, self.min_bars)
+        return len_
+
+    def update(self, cost):
+        """
+            account for a frame which took cost seconds and adjust the level
+        """
+        self.load = cost / (self.interval * self.frame_every)
+        if self.load > self.cpu_budget:
+            self._over += 1
+            self._under = 0
+            if (self._over >= self.patience) and (self.level < self.max_level):
+                self.level += 1
+                self._over = 0
+        elif self.load < self.cpu_budget / 2:
+            self._under += 1
+            self._over = 0
+            if (self._under >= self.patience) and (self.level > 0):
+                self.level -= 1
+                self._under = 0
+        else:
+            self._over = 0
+            self._under = 0
+
+class LoopOverhead(object):
+    """
+        resource usage of a Loop itself, e.g. to show that a progress display is cheap
+        (see Loop.overhead)
+
+        The values of the loop process are kept in shared memory and updated by the
+        loop process after each call of the loop function:
+            cpu_time - user and system CPU time in seconds
+            max_rss - peak resident set size in bytes (0 if not available)
+            ipc_messages - messages sent through the output pipe (output and log batches)
+            ipc_bytes - characters of output sent through the output pipe
+            lock_acquisitions - acquisitions of the instrumented locks in the loop process
+                                (see instrument, 0 if nothing is instrumented)
+        The values of a loop process restarted after a crash are added up.
+
+        The parent counts
+            terminal_bytes - characters of output passed to the pipe handler
+    """
+    FIELDS = ('cpu_time', 'max_rss', 'ipc_messages', 'ipc_bytes', 'lock_acquisitions')
+
+    def __init__(self):
+        self._values = mp.Array('d', len(self.FIELDS), lock=False)
+        self._base = None
+        self.terminal_bytes = 0
+        self.lock_acquisitions = 0
+        self._instrumented = set()
+
+    def instrument(self, args):
+        """
+            count the acquisitions of the locks of the synchronized shared values, locks
+            and queues found in args (nested in lists, tuples and dicts) (loop process)
+
+            The objects are modified in place, so only objects owned by the loop should be
+            passed (e.g. the shared values of a Progress with show_overhead).
+
+            Only the acquisitions of the loop process are counted, not those of other
+            processes using the same values (e.g. the workers incrementing the counters).
+            Locks held directly by a tuple can not be replaced and are not counted.
+        """
+        self.lock_acquisitions = 0
+        self._instrument(args)
+
+    def _instrument(self, args):
+        if isinstance(args, dict):
+            items = list(args.items())
+        else:
+            items = list(enumerate(args))
+        for k, x in items:
+            if id(x) in self._instrumented:
+                continue
+            if isinstance(x, SynchronizedBase):
+                # reading or writing .value calls self.acquire
+                self._instrumented.add(id(x))
+                x.acquire = _CountingLock(x.get_lock(), self).acquire
+            elif isinstance(x, mpQueue):
+                self._instrumented.add(id(x))
+                x._rlock = _CountingLock(x._rlock, self)
+                if x._wlock is not None:
+                    x._wlock = _CountingLock(x._wlock, self)
+            elif isinstance(x, _LOCK_TYPES):
+                if not isinstance(args, tuple):
+                    args[k] = _CountingLock(x, self)
+            elif isinstance(x, (list, tuple, dict)):
+                self._instrumented.add(id(x))
+                self._instrument(x)
+
+    def update(self, stdout, log_handler):
+        """
+            write the current usage of the loop process to shared memory (loop process)
+        """
+        if self._base is None:
+            # the values of an earlier process
+            self._base = self._values[:]
+        base = self._base
+        if resource is not None:
+            r = resource.getrusage(resource.RUSAGE_SELF)
+            self._values[0] = base[0] + r.ru_utime + r.ru_stime
+            max_rss = r.ru_maxrss
+            if sys.platform != 'darwin':
+                max_rss *= 1024
+            self._values[1] = max(base[1], max_rss)
+        else:
+            t = os.times()
+            self._values[0] = base[0] + t[0] + t[1]
+        self._values[2] = base[2] + getattr(stdout, 'messages', 0) + log_handler.messages
+        self._values[3] = base[3] + getattr(stdout, 'bytes', 0)
+        self._values[4] = base[4] + self.lock_acquisitions
+
+    def as_dict(self):
+        d = dict(zip(self.FIELDS, self._values[:]))
+        for k in ('max_rss', 'ipc_messages', 'ipc_bytes', 'lock_acquisitions'):
+            d[k] = int(d[k])
+        d['terminal_bytes'] = self.terminal_bytes
+        return d
+
+_LOCK_TYPES = (type(mp.Lock()), type(mp.RLock()))
+
+class _CountingLock(object):
+    """
+        a lock counting its acquisitions in overhead.lock_acquisitions (see LoopOverhead)
+    """
+    def __init__(self, lock, overhead):
+        self._lock = lock
+        self._overhead = overhead
+
+    def acquire(self, *args, **kwargs):
+        self._overhead.lock_acquisitions += 1
+        return self._lock.acquire(*args, **kwargs)
+
+    def release(self):
+        return self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
 
-class ProgressBarFancy(Progress):
+    def __getattr__(self, name):
+        # copy and pickle look up attributes before __init__ has set _lock
+        if name == '_lock':
+            raise AttributeError(name)
+        return getattr(self._lock, name)
+
+def format_overhead(overhead):
     """
-        implements a progress bar where the color indicates the current status
-        similar to the bars known from 'htop'
+        one line summary of the dict returned by Loop.overhead
     """
-    def __init__(self, *args, **kwargs):
-        """
-            width [int/'auto'] - the number of characters used to show the Progress bar,
-            use 'auto' to determine width from terminal information -> see _set_width
-        """            
-        Progress.__init__(self, *args, **kwargs)
-        
-    @staticmethod        
-    def get_d(s1, s2, width, lp, lps):
-        d = width-len(remove_ESC_SEQ_from_string(s1))-len(remove_ESC_SEQ_from_string(s2))-2-lp-lps
-        if d >= 0:
-            d1 = d // 2
-            d2 = d - d1
-            return s1, s2, d1, d2
+    return ("overhead: CPU {:.3g}s ({:.2%} of a core), max RSS {:.1f}MB, {} IPC messages ({:.1f}kB), "
+            "{} lock acquisitions, {:.1f}kB written").format(overhead['cpu_time'],
+                                                            overhead['cpu_fraction'],
+                                                            overhead['max_rss'] / 2**20,
+                                                            overhead['ipc_messages'],
+                                                            overhead['ipc_bytes'] / 2**10,
+                                                            overhead['lock_acquisitions'],
+                                                            overhead['terminal_bytes'] / 2**10)
+
+class TickMetrics(object):
+    """
+        timings of the stages of each tick of a Loop in fixed size histograms
+
+        The histograms are kept in shared memory, so the stages measured in the loop
+        process can be read by the parent. The stages are
+            tick - duration of the call of the loop function
+            jitter - how much later than planned the call started
+            calc - computing the statistics of the bars (Progress._calc)
+            format - formatting the bars (show_stat, without transport)
+            transport - sending the output through the pipe to the parent
+            write - writing the output in the parent (the pipe handler)
+
+        Bin 0 counts durations below 1us, bin b counts durations in [2^(b-1), 2^b) us,
+        the last bin counts all longer durations.
+
+        The hooks are only called if a TickMetrics instance has been passed to the Loop
+        (or Progress), otherwise they cost nothing.
+    """
+    STAGES = ('tick', 'jitter', 'calc', 'format', 'transport', 'write')
 
-    @staticmethod
-    def full_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
-        s1 = "TET {} {:>12} TTG {}".format(tet, speed, ttg)
-        s2 = "ETA {} ORT {}".format(eta, ort)
-        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)
+    def __init__(self, bins=26, debug_line=False):
+        """
+            bins [int] - number of bins of each histogram
 
+            debug_line [bool] - if True, Progress shows a line with the median and 99th
+            percentile of each stage below the bars
+        """
+        self.bins = bins
+        self.debug_line = debug_line
+        n = len(self.STAGES)
+        self._index = dict((s, k) for k, s in enumerate(self.STAGES))
+        self._counts = mp.Array('L', n*bins, lock=False)
+        self._sums = mp.Array('d', n, lock=False)
+        self._max = mp.Array('d', n, lock=False)
+        self._pending = {}
+
+    clock = staticmethod(getattr(time, 'perf_counter', time.time))
+
+    def record(self, stage, dt):
+        """
+            add a duration of dt seconds to the histogram of stage
+        """
+        k = self._index[stage]
+        b = min(int(dt*1e6).bit_length(), self.bins - 1) if dt > 0 else 0
+        self._counts[k*self.bins + b] += 1
+        self._sums[k] += dt
+        if dt > self._max[k]:
+            self._max[k] = dt
+
+    def add(self, stage, dt):
+        """
+            accumulate dt seconds for stage within the current tick (see commit)
+        """
+        self._pending[stage] = self._pending.get(stage, 0) + dt
 
-    @staticmethod
-    def full_minor_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
-        s1 = "E {} {:>12} G {}".format(tet, speed, ttg)
-        s2 = "A {} O {}".format(eta, ort)
-        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)
+    def pending(self, stage):
+        return self._pending.get(stage, 0)
 
-    @staticmethod
-    def reduced_1_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
-        s1 = "E {} {:>12} G {}".format(tet, speed, ttg)
-        s2 = "O {}".format(ort)
-        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)  
+    def commit(self):
+        """
+            record the durations accumulated by add at the end of a tick
+        """
+        for stage, dt in self._pending.items():
+            self.record(stage, dt)
+        self._pending = {}
 
-    @staticmethod
-    def reduced_2_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
-        s1 = "E {} G {}".format(tet, ttg)
-        s2 = "O {}".format(ort)
-        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)
-    
-    @staticmethod
-    def reduced_3_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
-        s1 = "E {} G {}".format(tet, ttg)
-        s2 = ''
-        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)
-    
-    @staticmethod
-    def reduced_4_stat(p, tet, speed, ttg, eta, ort, repl_ch, width, lp, lps):
-        s1 = ''
-        s2 = ''
-        return ProgressBarFancy.get_d(s1, s2, width, lp, lps)    
+    def histogram(self, stage):
+        """
+            list of (upper bound of the bin in seconds, count), the upper bound of the
+            last bin is None
+        """
+        k = self._index[stage]
+        counts = self._counts[k*self.bins:(k+1)*self.bins]
+        bounds = [2**b * 1e-6 for b in range(self.bins - 1)] + [None]
+        return list(zip(bounds, counts))
 
-    @staticmethod        
-    def kw_bold(s, ch_after):
-        kws = ['TET', 'TTG', 'ETA', 'ORT', 'E', 'G', 'A', 'O']
-        for kw in kws:
-            for c in ch_after:
-                s = s.replace(kw + c, ESC_BOLD + kw + ESC_RESET_BOLD + c)
-            
-        return s
+    def percentile(self, stage, p):
+        """
+            upper bound of the bin in which the p-th percentile of stage falls
+            (None if nothing was recorded)
+        """
+        hist = self.histogram(stage)
+        n = sum(c for b, c in hist)
+        if n == 0:
+            return None
+        k = self._index[stage]
+        c_sum = 0
+        for b, c in hist:
+            c_sum += c
+            if c_sum >= p/100 * n:
+                return b if b is not None else self._max[k]
+
+    def summary(self):
+        """
+            dict mapping each stage to a dict with count, mean, p50, p99 and max
+            (in seconds), stages without any records are left out
+        """
+        res = {}
+        for stage in self.STAGES:
+            k = self._index[stage]
+            n = sum(self._counts[k*self.bins:(k+1)*self.bins])
+            if n == 0:
+                continue
+            res[stage] = {'count': n,
+                          'mean' : self._sums[k] / n,
+                          'p50'  : self.percentile(stage, 50),
+                          'p99'  : self.percentile(stage, 99),
+                          'max'  : self._max[k]}
+        return res
+
+    def format_line(self):
+        """
+            one line with the median and 99th percentile of each stage (in ms)
+        """
+        s = self.summary()
+        return " ".join("{} {:.2g}/{:.2g}ms".format(stage, s[stage]['p50']*1e3, s[stage]['p99']*1e3)
+                        for stage in self.STAGES if stage in s)
 
-    @staticmethod        
-    def _stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
-        if (max_count_value is None) or (max_count_value == 0):
-            # only show current absolute progress as number and estimated speed
-            stat = "{}{} [{}] {}#{}    ".format(COLTHM['PRE_COL']+prepend+ESC_DEFAULT,
-                                                humanize_time(tet),
-                                                humanize_speed(speed),
-                                                COLTHM['BAR_COL'],
-                                                str(count_value) + ESC_DEFAULT)
-        else:
-            if width == 'auto':
-                width = get_terminal_width()
-            # deduce relative progress
-            p = count_value / max_count_value
-            if p < 1:
-                ps = " {:.1%} ".format(p)
-            else:
-                ps = " {:.0%} ".format(p)
-            
-            if ttg is None:
-                eta = '--'
-                ort = None
-            else:
-                eta = datetime.datetime.fromtimestamp(time.time() + ttg).strftime("%Y%m%d_%H:%M:%S")
-                ort = tet + ttg
-                
-            tet = humanize_time(tet)
-            speed = '['+humanize_speed(speed)+']'
-            ttg = humanize_time(ttg)
-            ort = humanize_time(ort)
-            repl_ch = '-'
-            lp = len(prepend)
-            
-            args = p, tet, speed, ttg, eta, ort, repl_ch, width, lp, len(ps)
-            
-            res = ProgressBarFancy.full_stat(*args)
-            if res is None:
-                res = ProgressBarFancy.full_minor_stat(*args)
-                if res is None:
-                    res = ProgressBarFancy.reduced_1_stat(*args)
-                    if res is None:
-                        res = ProgressBarFancy.reduced_2_stat(*args)
-                        if res is None:
-                            res = ProgressBarFancy.reduced_3_stat(*args)
-                            if res is None:
-                                res = ProgressBarFancy.reduced_4_stat(*args)
-                                    
-            if res is not None:
-                s1, s2, d1, d2 = res                
-                s = s1 + ' '*d1 + ps + ' '*d2 + s2
-                s_before = s[:math.ceil(width*p)].replace(' ', repl_ch)
-                if (len(s_before) > 0) and (s_before[-1] == repl_ch):
-                    s_before = s_before[:-1] + '>'
-                s_after  = s[math.ceil(width*p):]
-                
-                s_before = ProgressBarFancy.kw_bold(s_before, ch_after=[repl_ch, '>'])
-                s_after = ProgressBarFancy.kw_bold(s_after, ch_after=[' '])
-                stat = (COLTHM['PRE_COL']+prepend+ESC_DEFAULT+
-                        COLTHM['BAR_COL']+ESC_BOLD + '[' + ESC_RESET_BOLD + s_before + ESC_DEFAULT +
-                        s_after + ESC_BOLD + COLTHM['BAR_COL']+']' + ESC_NO_CHAR_ATTR)
-            else:
-                ps = ps.strip()
-                if p == 1:
-                    ps = ' '+ps
-                stat = prepend + ps
+class LineLog(object):
+    """
+        decides when to print a plain progress line in line log mode (see Progress)
 
-        return stat
+        A line for a process is printed only if its count has changed since the
+        last line. In addition, either interval seconds must have passed since
+        the last line, or the relative progress must have crossed a multiple
+        of milestone (e.g. 0.1 -> every 10%).
+    """
+    def __init__(self, interval=10, milestone=0.1):
+        self.interval = interval
+        self.milestone = milestone
+        self._last_time = {}
+        self._last_count = {}
+        self._last_milestone = {}
+        self._last_info = None
+
+    def due(self, i, count_value, max_count_value, now, force=False):
+        if not force:
+            if self._last_count.get(i) == count_value:
+                return False
+            if now - self._last_time.get(i, -float('inf')) < self.interval:
+                if not max_count_value or not self.milestone:
+                    return False
+                if int(count_value / max_count_value / self.milestone) == self._last_milestone.get(i):
+                    return False
+
+        self._last_time[i] = now
+        self._last_count[i] = count_value
+        if max_count_value and self.milestone:
+            self._last_milestone[i] = int(count_value / max_count_value / self.milestone)
+        return True
 
-    @staticmethod        
-    def show_stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
-        stat = ProgressBarFancy._stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs)
-        print(stat)
+    def info_due(self, s, force=False):
+        if (s == self._last_info) and not force:
+            return False
+        self._last_info = s
+        return True
 
-class ProgressBarCounterFancy(ProgressBarCounter):
     @staticmethod
-    def show_stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
-        counter_count = kwargs['counter_count'][i]
-        counter_speed = kwargs['counter_speed'][i]
-        counter_tet = time.time() - kwargs['init_time']
+    def line(count_value, max_count_value, prepend, speed, tet, ttg):
+        """
+            the progress as single line without escape sequences
+        """
+        prepend = remove_ESC_SEQ_from_string(prepend)
+        if (max_count_value is None) or (max_count_value == 0):
+            return "{}{} [{}] #{}".format(prepend, humanize_time(tet), humanize_speed(speed), count_value)
+        else:
+            return "{}{} [{}] #{}/{} {:.1%} TTG {}".format(prepend, humanize_time(tet), humanize_speed(speed),
+                                                          count_value, max_count_value,
+                                                          count_value / max_count_value, humanize_time(ttg))
 
-        s_c = "{}{}{} [{}] {}#{} - ".format(ESC_NO_CHAR_ATTR,
-                                            COLTHM['PRE_COL']+prepend+ESC_DEFAULT,
-                                            humanize_time(counter_tet),
-                                            humanize_speed(counter_speed.value),
-                                            COLTHM['BAR_COL'],
-                                            str(counter_count.value) + ESC_DEFAULT)
+class LoopLogHandler(logging.Handler):
+    """
+        logging handler which shows the log messages above the progress bars
+        by means of Loop.write
 
-        if width == 'auto':
-            width = get_terminal_width()        
+        example:
 
-        if (max_count_value is None) or (max_count_value == 0):
-            s_c = "{}{} [{}] {}#{}    ".format(s_c, humanize_time(tet), humanize_speed(speed),
-                                               COLTHM['BAR_COL'], str(count_value)+ESC_DEFAULT)
-        else:
-            _width = width - len_string_without_ESC(s_c)
-            s_c += ProgressBarFancy._stat(count_value, max_count_value, '', speed, tet, ttg, _width, i)
+            with ProgressBar(count=c, max_count=m) as pb:
+                log.addHandler(LoopLogHandler(pb))
+                pb.start()
+                ...
+    """
+    def __init__(self, loop, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.loop = loop
 
-        print(s_c)
-                        
+    def emit(self, record):
+        try:
+            self.loop.write(self.format(record))
+        except Exception:
+            self.handleError(record)
 
 class SIG_handler_Loop(object):
     """class to setup signal handling for the Loop class
@@ -1222,6 +3288,115 @@ class SIG_handler_Loop(object):
         self.log.info("received sig %s -> raise InterruptedError", signal_dict[signal])
         raise LoopInterruptError()
 
+def set_scheduling(cpu_affinity=None, nice=None, sched_idle=False, pid=0):
+    """
+        set the CPU affinity, the niceness and the scheduling policy of a process
+        (default the calling one)
+
+        Options not supported by the platform are skipped with a warning.
+    """
+    if cpu_affinity is not None:
+        try:
+            os.sched_setaffinity(pid, cpu_affinity)
+            log.debug("set cpu affinity to %s", cpu_affinity)
+        except (AttributeError, OSError, ValueError) as e:
+            log.warning("could not set cpu affinity to %s (%s)", cpu_affinity, e)
+    if nice is not None:
+        try:
+            if pid == 0:
+                os.nice(nice)
+            else:
+                os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, pid) + nice)
+            log.debug("increased niceness by %s", nice)
+        except (AttributeError, OSError) as e:
+            log.warning("could not increase niceness by %s (%s)", nice, e)
+    if sched_idle:
+        try:
+            os.sched_setscheduler(pid, os.SCHED_IDLE, os.sched_param(0))
+            log.debug("set scheduling policy to SCHED_IDLE")
+        except (AttributeError, OSError) as e:
+            log.warning("could not set scheduling policy to SCHED_IDLE (%s)", e)
+
+class MonotonicClock(object):
+    """
+        the default clock of the progress statistics and the loop interval (see set_clock)
+
+        time - monotonic seconds, used for all durations (TET, speed, TTG), so a jump
+            of the wall clock can not result in negative speeds
+        wall - the wall clock time, used for the time of arrival (ETA)
+        sleep - wait for some seconds
+    """
+    def time(self):
+        return _monotonic()
+
+    def wall(self):
+        return time.time()
+
+    def sleep(self, dt):
+        time.sleep(dt)
+
+class VirtualClock(object):
+    """
+        a clock which only moves when told to, for deterministic tests and benchmarks
+
+        The time is kept in shared memory, so a loop process started after set_clock
+        follows the clock advanced in the parent. With auto_advance, sleep advances
+        the clock instead of waiting, so a Loop runs as fast as it can. Otherwise
+        sleep waits (in real time) until the clock has been advanced far enough.
+        The clock should be advanced by one process only.
+
+            clock = VirtualClock()
+            set_clock(clock)
+            ...
+            clock.advance(1)
+    """
+    def __init__(self, start=0., wall_start=0., auto_advance=False):
+        """
+            start [float] - initial time
+
+            wall_start [float] - the wall clock time (timestamp) at start
+
+            auto_advance [bool] - sleep advances the clock
+        """
+        self._now = mp.Value('d', start, lock=False)
+        self._start = start
+        self.wall_start = wall_start
+        self.auto_advance = auto_advance
+
+    def time(self):
+        return self._now.value
+
+    def wall(self):
+        return self.wall_start + self._now.value - self._start
+
+    def advance(self, dt):
+        self._now.value += dt
+
+    def sleep(self, dt):
+        if self.auto_advance:
+            self.advance(dt)
+            return
+        t_end = self._now.value + dt
+        while self._now.value < t_end:
+            time.sleep(1e-3)
+
+_CLOCK = MonotonicClock()
+
+def set_clock(clock=None):
+    """
+        use clock (e.g. a VirtualClock) for the progress statistics and the interval of
+        the loops started from now on, None restores the default MonotonicClock
+
+        returns the clock used so far
+    """
+    global _CLOCK
+    old_clock = _CLOCK
+    _CLOCK = MonotonicClock() if clock is None else clock
+    return old_clock
+
+def get_clock():
+    return _CLOCK
+
 def FloatValue(val=0.):
     return mp.Value('d', val, lock=True)
 
@@ -1252,6 +3427,9 @@ def check_process_termination(proc, prefix, timeout, auto_kill_on_last_resort =
     log.warning("termination of process (pid %s) via SIGTERM with timeout of %ss FAILED!", proc.pid, new_timeout)
 
     log.debug("auto_kill_on_last_resort is %s", auto_kill_on_last_resort)
+    if not auto_kill_on_last_resort and not _isatty(sys.stdin):
+        log.info("stdin is not a terminal, can not ask whether to send SIGKILL")
+        auto_kill_on_last_resort = True
     answer = 'k' if auto_kill_on_last_resort else '_'
     while True:
         log.debug("answer string is %s", answer)
@@ -1285,6 +3463,135 @@ def check_process_termination(proc, prefix, timeout, auto_kill_on_last_resort =
         elif answer != 'k':
             answer = ''
 
+def _wait_processes(procs, timeout):
+    """
+        wait at most timeout seconds for all processes to terminate,
+        return the processes still running
+    """
+    deadline = time.time() + timeout
+    alive = [p for p in procs if p.is_alive()]
+    while alive:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        if mp_connection_wait is not None:
+            mp_connection_wait([p.sentinel for p in alive], remaining)
+        else:
+            alive[0].join(remaining)
+        alive = [p for p in alive if p.is_alive()]
+    return alive
+
+def check_processes_termination(procs, timeout, auto_kill_on_last_resort = False):
+    """
+        like check_process_termination but for many processes at once
+
+        Waits at most timeout seconds for all processes to terminate, then sends SIGTERM
+        to all remaining ones and waits at most 3*timeout. The processes still running
+        are killed if auto_kill_on_last_resort is True or stdin is not a terminal.
+        Otherwise the user is asked for each of them (see check_process_termination).
+
+        Returns True if all processes terminated.
+    """
+    alive = _wait_processes(procs, timeout)
+    if not alive:
+        log.debug("termination of %s processes within timeout of %ss SUCCEEDED!", len(procs), timeout)
+        return True
+
+    log.warning("termination of processes (pids %s) within given timeout of %ss FAILED!",
+                [p.pid for p in alive], timeout)
+    for p in alive:
+        p.terminate()
+    alive = _wait_processes(alive, 3*timeout)
+    if not alive:
+        log.info("termination of processes via SIGTERM with timeout of %ss SUCCEEDED!", 3*timeout)
+        return True
+
+    if not auto_kill_on_last_resort and _isatty(sys.stdin):
+        return all([check_process_termination(p, prefix='', timeout=0) for p in alive])
+
+    for p in alive:
+        log.warning("send SIGKILL to process with pid %s", p.pid)
+        try:
+            os.kill(p.pid, signal.SIGKILL)
+        except OSError as e:
+            # the process may have terminated in the meantime
+            if e.errno != errno.ESRCH:
+                raise
+    alive = _wait_processes(alive, 1)
+    for p in alive:
+        log.error("process (pid %s) is still running after SIGKILL!", p.pid)
+    return not alive
+
+def stop_all(loops, timeout=None):
+    """
+        stop many Loop (or Progress) instances at once
+
+        All loop processes are signaled to stop first and their termination is
+        awaited together (see check_processes_termination), so the time needed
+        does not grow with the number of loops. Then stop is called for each loop
+        to clean up (and to show the final progress). Never asks for user input
+        when stdin is not a terminal.
+
+        timeout [None, float] - time to wait before sending SIGTERM again, default is
+        twice the largest interval of the loops
+
+        The first LoopExceptionError raised by a stop call is re-raised after all
+        loops have been stopped.
+    """
+    loops = list(loops)
+    for l in loops:
+        if l._supervisor_thread is not None:
+            l._supervisor_stop.set()
+    for l in loops:
+        l._stop_supervisor()
+    running = [l for l in loops if l.is_alive()]
+    if timeout is None:
+        timeout = 2*max([l.interval for l in running] or [0])
+    for l in running:
+        l.run = False
+        l._proc.terminate()
+    check_processes_termination([l._proc for l in running],
+                                timeout                  = timeout,
+                                auto_kill_on_last_resort = all([l._auto_kill_on_last_resort for l in running]))
+    error = None
+    for l in loops:
+        try:
+            l.stop()
+        except LoopExceptionError as e:
+            if error is None:
+                error = e
+    if error is not None:
+        raise error
+
+# maximum waiting time before a crashed loop process is restarted, see Loop._supervise
+_RESTART_BACKOFF_MAX = 60
+
+# time (in seconds) after which the supervisor of a Loop checks whether it was stopped
+_SUPERVISE_TIMEOUT = 0.1
+
+# minimum time (in seconds) to wait for the output threads of a Loop on stop,
+# even if its interval is shorter (or 0)
+_JOIN_TIMEOUT_MIN = 1
+
+# all loops which have been started and not yet stopped, see _stop_registered_loops
+_LOOP_REGISTRY = set()
+
+def _stop_registered_loops():
+    """
+        stop all loops still running when the interpreter exits (registered with atexit)
+    """
+    loops = [l for l in _LOOP_REGISTRY if l.is_alive()]
+    if not loops:
+        return
+    log.debug("stop %s loops still running at exit", len(loops))
+    try:
+        stop_all(loops)
+    except Exception as e:
+        log.error("error %s occurred when stopping the loops at exit", type(e))
+        log.info(traceback.format_exc())
+
+atexit.register(_stop_registered_loops)
+
 def getCountKwargs(func):
     """ Returns a list ["count kwarg", "count_max kwarg"] for a
     given function. Valid combinations are defined in 
@@ -1347,6 +3654,12 @@ def get_terminal_size(defaultw=80):
                     return (defaultw, None)
 
     
+def _isatty(stream):
+    try:
+        return stream.isatty()
+    except Exception:
+        return False
+
 def get_terminal_width(default=80, name=None):
     try:
         width = get_terminal_size(defaultw=default)[0]
@@ -1355,23 +3668,31 @@ def get_terminal_width(default=80, name=None):
     return width
 
 
+# (factor, format) to convert counts per second to counts per [s, min, h, d]
+_SPEED_UNITS = [(1,        "{:.1f}c/s"),
+                (60,       "{:.1f}c/min"),
+                (60*60,    "{:.1f}c/h"),
+                (60*60*24, "{:.1f}c/d")]
+
 def humanize_speed(c_per_sec):
     """convert a speed in counts per second to counts per [s, min, h, d], choosing the smallest value greater zero.
     """
-    scales = [60, 60, 24]
-    units = ['c/s', 'c/min', 'c/h', 'c/d']
-    speed = c_per_sec
-    i = 0
-    if speed > 0:
-        while (speed < 1) and (i < len(scales)):
-            speed *= scales[i]
-            i += 1
-        
-    return "{:.1f}{}".format(speed, units[i])
+    if c_per_sec > 0:
+        for factor, fmt in _SPEED_UNITS:
+            speed = c_per_sec * factor
+            if speed >= 1:
+                return fmt.format(speed)
+        return fmt.format(speed)
+    return _SPEED_UNITS[0][1].format(c_per_sec)
 
 
+_humanize_time_cache = {}
+
 def humanize_time(secs):
     """convert second in to hh:mm:ss format
+
+    For ten seconds and more the result depends on the integer seconds only
+    and is cached.
     """
     if secs is None:
         return '--'
@@ -1381,129 +3702,202 @@ def humanize_time(secs):
     elif secs < 10:
         return "{:.2f}s".format(secs)
     else:
-        mins, secs = divmod(secs, 60)
-        hours, mins = divmod(mins, 60)
-        return '{:02d}:{:02d}:{:02d}'.format(int(hours), int(mins), int(secs))
+        secs = int(secs)
+        s = _humanize_time_cache.get(secs)
+        if s is None:
+            s = '{:02d}:{:02d}:{:02d}'.format(secs // 3600, (secs // 60) % 60, secs % 60)
+            if len(_humanize_time_cache) >= 4096:
+                _humanize_time_cache.clear()
+            _humanize_time_cache[secs] = s
+        return s
+
+
+_bar_body_cache = {}
+
+def _bar_body(a, b):
+    """
+        the body of a bar '==>  ' with a times '=' and b times ' ' (cached)
+    """
+    body = _bar_body_cache.get((a, b))
+    if body is None:
+        body = "=" * a + ">" + " " * b
+        if len(_bar_body_cache) >= 4096:
+            _bar_body_cache.clear()
+        _bar_body_cache[(a, b)] = body
+    return body
     
 
 
+# an escape sequence is ESC[ followed by digits and a single terminating character
+_ESC_SEQ_RE = re.compile("\033\\[[0-9]*.", re.DOTALL)
+_ESC_CACHE_MAX_LEN = 128
+_ESC_CACHE_SIZE = 256
+_len_without_ESC_cache = {}
+_remove_ESC_cache = {}
+
+def _cache_put(cache, key, value):
+    if len(cache) >= _ESC_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+
 def len_string_without_ESC(s):
-    return len(remove_ESC_SEQ_from_string(s))
+    """
+        the number of visible characters in s, i.e. the length of s
+        without any escape sequences
 
-def remove_ESC_SEQ_from_string(s):
-    old_idx = 0
-    new_s = ""
-    ESC_CHAR_START = "\033["
-    while True:
-        idx = s.find(ESC_CHAR_START, old_idx)
-        if idx == -1:
-            break
-        j = 2
-        while s[idx+j] in '0123456789':
-            j += 1
+        The stripped string is not build. Short strings (such as the prepend labels)
+        are cached.
+    """
+    if "\033" not in s:
+        return len(s)
+    l = _len_without_ESC_cache.get(s)
+    if l is None:
+        l = len(s)
+        for m in _ESC_SEQ_RE.finditer(s):
+            l -= m.end() - m.start()
+        if len(s) <= _ESC_CACHE_MAX_LEN:
+            _cache_put(_len_without_ESC_cache, s, l)
+    return l
 
-        new_s += s[old_idx:idx]
-        old_idx = idx+j+1
+def remove_ESC_SEQ_from_string(s):
+    """
+        remove all escape sequences from s
 
-    new_s += s[old_idx:]
+        Short strings (such as the prepend labels) are cached.
+    """
+    if "\033" not in s:
+        return s
+    new_s = _remove_ESC_cache.get(s)
+    if new_s is None:
+        new_s = _ESC_SEQ_RE.sub("", s)
+        if len(s) <= _ESC_CACHE_MAX_LEN:
+            _cache_put(_remove_ESC_cache, s, new_s)
     return new_s
 
-    # for esc_seq in ESC_SEQ_SET:
-    #     s = s.replace(esc_seq, '')
-    # return s
+# splits a string into text and escape sequences (odd indices)
+_ESC_SEQ_SPLIT_RE = re.compile("(\033\\[[0-9]*.)", re.DOTALL)
+_HTML_TRANSITION_CACHE = {}
+_HTML_LINE_CACHE = {}
+_HTML_LINE_CACHE_SIZE = 1024
 
 def _close_kind(stack, which_kind):
-    stack_tmp = []
-    s = ""
-
-    # close everything until which_kind is found
-    while True:
-        kind, start, end = stack.pop()
-        if kind != which_kind:
-            s += end
-            stack_tmp.append((kind, start, end))
-        else:
-            break
-
-    # close which_kind
-    s = end
-
-    # start everything that was closed before which_kind
-    for kind, start, end in stack_tmp:
-        s += start
-        stack.append((kind, start, end))
+    """
+        close the tag of kind which_kind, all tags opened after it are closed before
+        and reopened afterwards
 
-    return s
+        returns the html and the new stack
+    """
+    idx = [kind for kind, start, end in stack].index(which_kind)
+    above = stack[idx+1:]
+    s = "".join(end for kind, start, end in reversed(above)) + stack[idx][2]
+    s += "".join(start for kind, start, end in above)
+    return s, stack[:idx] + above
 
 def _close_all(stack):
-    s = ""
-    for kind, start, end in stack:
-        s += end
-    return s
+    return "".join(end for kind, start, end in reversed(stack))
 
 def _open_color(stack, color):
     start = '<span style="color:{}">'.format(color)
-    end = '</span>'
-    stack.append(('color', start, end))
-    return start
+    return start, stack + (('color', start, '</span>'),)
 
 def _open_bold(stack):
-    start = '<b>'
-    end = '</b>'
-    stack.append(('bold', start, end))
-    return start
+    return '<b>', stack + (('bold', '<b>', '</b>'),)
 
-def ESC_SEQ_to_HTML(s):
-    old_idx = 0
+def _ESC_SEQ_transition(stack, escseq):
+    """
+        the html to emit and the new stack of open tags when escseq is encountered
+        given the tuple of open tags stack
+    """
+    res = _HTML_TRANSITION_CACHE.get((stack, escseq))
+    if res is not None:
+        return res
+
+    kinds = [kind for kind, start, end in stack]
     new_s = ""
-    ESC_CHAR_START = "\033["
-    color_on = False
-    bold_on = False
-    stack = []
-    while True:
-        idx = s.find(ESC_CHAR_START, old_idx)
-        if idx == -1:
-            break
-        j = 2
-        while s[idx + j] in '0123456789':
-            j += 1
-
-        new_s += s[old_idx:idx]
-        old_idx = idx + j + 1
-        escseq = s[idx:idx+j+1]
-
-        if escseq in ESC_COLOR_TO_HTML:  # set color
-            if color_on:
-                new_s += _close_kind(stack, which_kind = 'color')
-            new_s += _open_color(stack, ESC_COLOR_TO_HTML[escseq])
-            color_on = True
-        elif escseq == ESC_DEFAULT:      # unset color
-            if color_on:
-                new_s += _close_kind(stack, which_kind = 'color')
-                color_on = False
-        elif escseq == ESC_BOLD:
-            if not bold_on:
-                new_s += _open_bold(stack)
-                bold_on = True
-        elif escseq == ESC_RESET_BOLD:
-            if bold_on:
-                new_s += _close_kind(stack, which_kind = 'bold')
-                bold_on = False
-        elif escseq == ESC_NO_CHAR_ATTR:
-            if color_on:
-                new_s += _close_kind(stack, which_kind = 'color')
-                color_on = False
-            if bold_on:
-                new_s += _close_kind(stack, which_kind = 'bold')
-                bold_on = False
+    new_stack = stack
+    if escseq in ESC_COLOR_TO_HTML:  # set color
+        if 'color' in kinds:
+            new_s, new_stack = _close_kind(new_stack, which_kind = 'color')
+        s, new_stack = _open_color(new_stack, ESC_COLOR_TO_HTML[escseq])
+        new_s += s
+    elif escseq == ESC_DEFAULT:      # unset color
+        if 'color' in kinds:
+            new_s, new_stack = _close_kind(new_stack, which_kind = 'color')
+    elif escseq == ESC_BOLD:
+        if 'bold' not in kinds:
+            new_s, new_stack = _open_bold(new_stack)
+    elif escseq == ESC_RESET_BOLD:
+        if 'bold' in kinds:
+            new_s, new_stack = _close_kind(new_stack, which_kind = 'bold')
+    elif escseq == ESC_NO_CHAR_ATTR:
+        new_s = _close_all(new_stack)
+        new_stack = ()
+
+    res = (new_s, new_stack)
+    _HTML_TRANSITION_CACHE[(stack, escseq)] = res
+    return res
+
+def _ESC_SEQ_line_to_HTML(line, stack):
+    """
+        convert a single line given the tags which are open at its beginning,
+        returns the html and the tags open at the end of the line
+    """
+    key = (line, stack)
+    res = _HTML_LINE_CACHE.get(key)
+    if res is not None:
+        return res
+
+    parts = _ESC_SEQ_SPLIT_RE.split(line)
+    html = []
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            html.append(part)
         else:
-            pass
+            s, stack = _ESC_SEQ_transition(stack, part)
+            html.append(s)
 
-    new_s += s[old_idx:]
-    new_s += _close_all(stack)
+    res = ("".join(html), stack)
+    if len(_HTML_LINE_CACHE) >= _HTML_LINE_CACHE_SIZE:
+        _HTML_LINE_CACHE.clear()
+    _HTML_LINE_CACHE[key] = res
+    return res
 
-    return new_s
+def ESC_SEQ_to_HTML(s):
+    """
+        convert the escape sequences for color and bold into html tags,
+        all other escape sequences are removed
+
+        The conversion is done line by line. Since most lines (prepend, info line,
+        bars that did not change) recur from frame to frame the html of a line
+        is cached.
+    """
+    stack = ()
+    html = []
+    for line in s.split('\n'):
+        h, stack = _ESC_SEQ_line_to_HTML(line, stack)
+        html.append(h)
+    return '\n'.join(html) + _close_all(stack)
+
+def ESC_SEQ_to_HTML_lines(s):
+    """
+        like ESC_SEQ_to_HTML but return a list with the html of each line,
+        every line is self-contained, i.e. tags still open at the end of a line
+        are closed and reopened at the beginning of the next line
+
+        Trailing lines without visible characters (e.g. the cursor movement at the
+        end of a frame) are dropped.
+    """
+    lines = s.split('\n')
+    while lines and len_string_without_ESC(lines[-1]) == 0:
+        lines.pop()
 
+    stack = ()
+    html = []
+    for line in lines:
+        start = "".join(start for kind, start, end in stack)
+        h, stack = _ESC_SEQ_line_to_HTML(line, stack)
+        html.append(start + h + _close_all(stack))
+    return html
 
 
 def terminal_reserve(progress_obj, terminal_obj=None, identifier=None):
@@ -1600,6 +3994,8 @@ def ESC_MOVE_LINE_DOWN(n):
     return "\033[{}B".format(n)
 
 ESC_NO_CHAR_ATTR  = "\033[0m"
+ESC_ERASE_LINE    = "\033[2K"
+ESC_ERASE_DOWN    = "\033[J"
 
 ESC_BOLD          = "\033[1m"
 ESC_DIM           = "\033[2m"
@@ -1658,6 +4054,8 @@ ESC_COLOR_TO_HTML = {
     ESC_WHITE         : '#ffffff'}
 
 ESC_SEQ_SET = [ESC_NO_CHAR_ATTR,
+               ESC_ERASE_LINE,
+               ESC_ERASE_DOWN,
                ESC_BOLD,
                ESC_DIM,
                ESC_UNDERLINED,
@@ -1703,10 +4101,17 @@ def choose_color_theme(name):
         warnings.warn("no such color theme {}".format(name))
 
 
+# the plain variant of the fancy show_stat and stat_line functions, see RenderBudget
+PLAIN_SHOW_STAT = {ProgressBarFancy.show_stat       : ProgressBar.show_stat,
+                   ProgressBarCounterFancy.show_stat: ProgressBarCounter.show_stat,
+                   ProgressBarFancy.stat_line       : ProgressBar.stat_line,
+                   ProgressBarCounterFancy.stat_line: ProgressBarCounter.stat_line}
+
 # terminal reservation list, see terminal_reserve
 TERMINAL_RESERVATION = {}
 # these are classes that print progress bars, see terminal_reserve
-TERMINAL_PRINT_LOOP_CLASSES = ["ProgressBar", "ProgressBarCounter", "ProgressBarFancy", "ProgressBarCounterFancy"]
+TERMINAL_PRINT_LOOP_CLASSES = ["ProgressBar", "ProgressBarCounter", "ProgressBarFancy", "ProgressBarCounterFancy",
+                               "ProgressBarColumns"]
 
 # keyword arguments that define counting in wrapped functions
 validCountKwargs = [
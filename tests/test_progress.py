@@ -8,10 +8,16 @@ import numpy as np
 import os
 import psutil
 import signal
+import subprocess
 import sys
+import threading
 import time
 import traceback
+import copy
+import datetime
 import io
+import json
+import math
 
 import warnings
 
@@ -206,6 +212,26 @@ def test_loop_stdout_pipe():
     test_string = test_string+"\n"
     assert cap_out == test_string
             
+def test_loop_scheduling():
+    if not hasattr(os, 'sched_setaffinity'):
+        return
+    cpus = sorted(os.sched_getaffinity(0))[:1]
+    nice = os.nice(0)
+    try:
+        loop = progression.Loop(func=normal_function, interval=INTERVAL,
+                                cpu_affinity=cpus, nice=5, sched_idle=True)
+        loop.start()
+        time.sleep(INTERVAL)
+        pid = loop.getpid()
+        assert os.sched_getaffinity(pid) == set(cpus)
+        assert psutil.Process(pid).nice() == nice + 5
+        assert os.sched_getscheduler(pid) == os.SCHED_IDLE
+        loop.stop()
+        # the parent is not affected
+        assert os.nice(0) == nice
+    finally:
+        _kill_pid(loop.getpid())
+
 def test_loop_pause():
    
     myout = inMemoryBuffer()
@@ -290,6 +316,526 @@ def test_loop_need_sigkill_to_stop():
     finally:
         _kill_pid(loop.getpid())        
         
+def test_stop_all():
+    n = 10
+    loops = [progression.Loop(func=normal_function, interval=INTERVAL) for i in range(n)]
+    try:
+        for l in loops:
+            l.start()
+        time.sleep(INTERVAL)
+        t0 = time.time()
+        progression.stop_all(loops)
+        assert time.time() - t0 < 2*INTERVAL
+        for l in loops:
+            _safe_assert_not_loop_is_alive(l)
+    finally:
+        for l in loops:
+            _kill_pid(l.getpid())
+
+def test_stop_all_need_sigkill():
+    loops = [progression.Loop(func=long_sleep_function, interval=INTERVAL, sigint='ign', sigterm='ign')
+             for i in range(3)]
+    try:
+        for l in loops:
+            l.start()
+        time.sleep(INTERVAL)
+        # stdin is not a terminal while testing, so there is no question whether to send SIGKILL
+        t0 = time.time()
+        progression.stop_all(loops, timeout=INTERVAL/2)
+        assert time.time() - t0 < 6*INTERVAL
+        for l in loops:
+            _safe_assert_not_loop_is_alive(l)
+    finally:
+        for l in loops:
+            _kill_pid(l.getpid())
+
+def test_loop_registry():
+    loop = progression.Loop(func=normal_function, interval=INTERVAL)
+    try:
+        loop.start()
+        assert loop in progression.progress._LOOP_REGISTRY
+        loop.stop()
+        assert loop not in progression.progress._LOOP_REGISTRY
+    finally:
+        _kill_pid(loop.getpid())
+
+def test_loop_orphan():
+    shared_pid = progression.UnsignedIntValue()
+
+    def loopf(shared_pid):
+        shared_pid.value = os.getpid()
+
+    def f(shared_pid):
+        loop = progression.Loop(func=loopf, args=(shared_pid,), interval=INTERVAL)
+        loop.start()
+        time.sleep(60)
+
+    p = mp.Process(target=f, args=(shared_pid, ))
+    p.start()
+    time.sleep(2*INTERVAL)
+    pid = shared_pid.value
+    assert pid != 0
+    # the parent of the loop process dies without any cleanup
+    os.kill(p.pid, signal.SIGKILL)
+    p.join()
+    time.sleep(3*INTERVAL)
+    try:
+        assert not psutil.pid_exists(pid) or psutil.Process(pid).status() == psutil.STATUS_ZOMBIE
+    finally:
+        _kill_pid(pid)
+
+def test_loop_atexit():
+    script = ("import sys, time\n"
+              "sys.path.insert(0, {!r})\n"
+              "import progression\n"
+              "def f():\n"
+              "    pass\n"
+              "loop = progression.Loop(func=f, interval=0.1)\n"
+              "loop.start()\n"
+              "time.sleep(0.2)\n"
+              "print(loop.getpid())\n").format(split(dirname(abspath(__file__)))[0])
+    out = subprocess.check_output([sys.executable, '-c', script])
+    pid = int(out.decode().strip().split('\n')[-1])
+    time.sleep(INTERVAL)
+    try:
+        assert not psutil.pid_exists(pid) or psutil.Process(pid).status() == psutil.STATUS_ZOMBIE
+    finally:
+        _kill_pid(pid)
+
+def test_loop_restart():
+    calls = progression.UnsignedIntValue()
+
+    def f(calls):
+        with calls.get_lock():
+            calls.value += 1
+        if calls.value == 2:
+            raise RuntimeError("crash the loop process")
+
+    loop = progression.Loop(func=f, args=(calls,), interval=INTERVAL, max_restarts=2, restart_backoff=INTERVAL)
+    try:
+        loop.start()
+        time.sleep(6*INTERVAL)
+        # the crash in the second call was healed
+        assert loop.is_alive()
+        assert loop.restarts == 1
+        assert calls.value > 2
+
+        # a process killed from outside (e.g. the OOM killer) gets restarted too
+        pid = loop.getpid()
+        os.kill(pid, signal.SIGKILL)
+        time.sleep(5*INTERVAL)
+        assert loop.is_alive()
+        assert loop.getpid() != pid
+        assert loop.restarts == 2
+
+        # no restarts left
+        os.kill(loop.getpid(), signal.SIGKILL)
+        time.sleep(5*INTERVAL)
+        assert not loop.is_alive()
+        assert loop.restarts == 2
+        loop.stop()
+    finally:
+        _kill_pid(loop.getpid())
+
+def _sleep_func():
+    time.sleep(INTERVAL/10)
+
+def test_loop_restart_interval_0():
+    # the supervisor must not poll with the interval of the loop
+    loop = progression.Loop(func=_sleep_func, interval=0, max_restarts=1)
+    try:
+        loop.start()
+        t0 = time.time()
+        c0 = psutil.Process().cpu_times()
+        time.sleep(5*INTERVAL)
+        c1 = psutil.Process().cpu_times()
+        assert (c1.user + c1.system) - (c0.user + c0.system) < 0.2*(time.time() - t0)
+        loop.stop()
+    finally:
+        _kill_pid(loop.getpid())
+
+def test_progress_restart():
+    count = progression.UnsignedIntValue()
+    max_count = progression.UnsignedIntValue(100)
+    with progression.ProgressBar(count=count, max_count=max_count, interval=INTERVAL,
+                                 max_restarts=1, restart_backoff=INTERVAL) as sbm:
+        sbm.start()
+        count.value = 10
+        time.sleep(2*INTERVAL)
+        os.kill(sbm.getpid(), signal.SIGKILL)
+        count.value = 20
+        time.sleep(4*INTERVAL)
+        assert sbm.is_alive()
+        assert sbm.restarts == 1
+        assert sbm.last_count[0].value == 20
+
+def _stuck_func(calls):
+    with calls.get_lock():
+        calls.value += 1
+    if calls.value == 2:
+        # a blocking call which never returns
+        threading.Event().wait()
+
+def test_loop_tick_timeout():
+    calls = progression.UnsignedIntValue()
+    loop = progression.Loop(func=_stuck_func, args=(calls,), interval=INTERVAL,
+                            tick_timeout=INTERVAL, on_tick_timeout='abandon')
+    try:
+        loop.start()
+        time.sleep(7*INTERVAL)
+        # the stuck second call was abandoned, the loop keeps ticking
+        assert loop.is_alive()
+        assert calls.value > 3
+        reports = loop.get_tick_reports()
+        assert len(reports) == 1
+        r = reports[0]
+        assert r.pid == loop.getpid()
+        assert r.tick == 2
+        assert r.action == 'abandon'
+        assert r.duration >= INTERVAL
+        assert "_stuck_func" in r.stack
+        assert loop.get_tick_reports() == []
+        loop.stop()
+    finally:
+        _kill_pid(loop.getpid())
+
+def test_loop_tick_timeout_restart():
+    calls = progression.UnsignedIntValue()
+    loop = progression.Loop(func=_stuck_func, args=(calls,), interval=INTERVAL,
+                            tick_timeout=INTERVAL, on_tick_timeout='restart',
+                            max_restarts=1, restart_backoff=INTERVAL)
+    try:
+        loop.start()
+        time.sleep(8*INTERVAL)
+        assert loop.is_alive()
+        assert loop.restarts == 1
+        assert calls.value > 3
+        assert [r.action for r in loop.get_tick_reports()] == ['restart']
+        loop.stop()
+    finally:
+        _kill_pid(loop.getpid())
+
+def _task_inc(v):
+    with v.get_lock():
+        v.value += 1
+
+def _task_fail():
+    raise ValueError("task failed")
+
+def _task_done():
+    return True
+
+def _task_inc_done(c):
+    c.value += 1
+    return True
+
+def test_loop_scheduler():
+    fast = progression.UnsignedIntValue()
+    slow = progression.UnsignedIntValue()
+    with progression.LoopScheduler() as s:
+        s.add_task('fast', _task_inc, args=(fast,), interval=INTERVAL/4)
+        s.add_task('slow', _task_inc, args=(slow,), interval=2*INTERVAL)
+        s.start()
+        # tasks added and removed at runtime
+        s.add_task('fail', _task_fail, interval=INTERVAL)
+        s.add_task('done', _task_done, interval=INTERVAL)
+        time.sleep(5*INTERVAL)
+        stats = s.get_task_stats()
+        s.remove_task('fast')
+        time.sleep(INTERVAL)
+        fast_value = fast.value
+        time.sleep(2*INTERVAL)
+        assert fast.value == fast_value
+
+        assert 12 <= stats['fast'].calls <= 22
+        assert 2 <= stats['slow'].calls <= 4
+        assert stats['fast'].errors == 0
+        assert stats['fail'].errors == stats['fail'].calls >= 4
+        assert stats['fail'].last_error == "ValueError: task failed"
+        # a task returning True is removed
+        assert 'done' not in stats
+        assert sorted(s.get_task_stats().keys()) == ['fail', 'slow']
+        assert s.is_alive()
+
+def test_loop_scheduler_restart():
+    done = progression.UnsignedIntValue()
+    with progression.LoopScheduler(max_restarts=1, restart_backoff=INTERVAL/4) as s:
+        s.add_task('done', _task_inc_done, args=(done,), interval=INTERVAL/4)
+        s.start()
+        time.sleep(INTERVAL)
+        assert 'done' not in s.get_task_stats()
+        # the task returned True, a restarted loop process does not run it again
+        os.kill(s.getpid(), signal.SIGKILL)
+        time.sleep(2*INTERVAL)
+        assert s.restarts == 1
+        assert done.value == 1
+
+def _channel_func(channel, tick):
+    tick.value += 1
+    channel.send(tick.value, channel.get_config()['factor']*tick.value)
+
+def test_loop_channel():
+    channel = progression.LoopChannel(fields=('tick', 'value'), size=8, config={'factor': 1})
+    tick = progression.UnsignedIntValue()
+    with progression.Loop(func=_channel_func, args=(channel, tick), interval=INTERVAL/4) as loop:
+        loop.start()
+        time.sleep(INTERVAL)
+        records = channel.recv()
+        assert len(records) > 0
+        assert [r.tick for r in records] == list(range(1, len(records)+1))
+        assert all([r.value == r.tick for r in records])
+
+        # reconfigure the running loop
+        channel.set_config(factor=2)
+        time.sleep(INTERVAL)
+        last_tick = records[-1].tick
+        records = channel.recv()
+        assert records[0].tick == last_tick + 1
+        assert records[-1].value == 2*records[-1].tick
+
+        # the ring buffer holds 8 records, older ones are lost (the oldest
+        # record is dropped too as it might be overwritten while reading)
+        lost = channel.lost
+        time.sleep(4*INTERVAL)
+        records = channel.recv()
+        assert 7 <= len(records) <= 8
+        assert channel.lost > lost
+        assert records[-1].tick == tick.value or records[-1].tick == tick.value - 1
+        loop.stop()
+
+    # a new loop process inherits the current settings
+    assert channel.get_config() == {'factor': 2}
+
+def test_loop_channel_restart():
+    channel = progression.LoopChannel(fields=('tick', 'value'), size=64, config={'factor': 1})
+    tick = progression.UnsignedIntValue()
+    with progression.Loop(func=_channel_func, args=(channel, tick), interval=INTERVAL/4,
+                          max_restarts=1, restart_backoff=INTERVAL/4) as loop:
+        loop.start()
+        time.sleep(INTERVAL)
+        # the loop process gets killed while reading an update of the settings
+        channel._config_queue._rlock.acquire()
+        os.kill(loop.getpid(), signal.SIGKILL)
+        time.sleep(2*INTERVAL)
+        assert loop.restarts == 1
+        channel.set_config(factor=3)
+        time.sleep(INTERVAL)
+        records = channel.recv()
+        assert records[-1].value == 3*records[-1].tick
+
+def test_log_batch_handler():
+    conn_recv, conn_send = mp.Pipe(False)
+    h = progression.progress._LogBatchHandler(conn_send, capacity=3)
+    l = logging.getLogger('test_log_batch_handler')
+    l.propagate = False
+    l.setLevel(logging.DEBUG)
+    l.addHandler(h)
+    try:
+        for i in range(50):
+            l.debug("step %s", i)
+        l.info("done")
+        h.flush()
+        records = conn_recv.recv()
+        assert [r.getMessage() for r in records] == ["step 49 (49 similar records coalesced)", "done"]
+        assert records[0].process == os.getpid()
+
+        for i in range(5):
+            h.handle(logging.makeLogRecord({'msg': "line {}".format(i), 'lineno': i}))
+        h.flush()
+        records = conn_recv.recv()
+        assert [r.getMessage() for r in records] == ["line 0", "line 1", "line 2", "2 log records dropped"]
+        h.flush()
+        assert not conn_recv.poll()
+    finally:
+        l.removeHandler(h)
+
+class _RecordingHandler(object):
+    """
+        pipe handler keeping the output and the messages written above the bars
+    """
+    def __init__(self):
+        self.out = []
+    def __call__(self, b):
+        self.out.append(b)
+    def flush(self):
+        pass
+    def write_message(self, msg, erase=True):
+        self.out.append(('msg', msg, erase))
+
+class _CollectHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+    def emit(self, record):
+        self.records.append(record)
+
+def _logging_func(n):
+    logging.getLogger('test_loop_logging').warning("tick %s", n.value)
+    n.value += 1
+
+def test_loop_logging_forwarded():
+    h = _CollectHandler()
+    l = logging.getLogger('test_loop_logging')
+    l.addHandler(h)
+    n = progression.UnsignedIntValue()
+    try:
+        with progression.Loop(func=_logging_func, args=(n,), interval=INTERVAL) as loop:
+            loop.start()
+            time.sleep(2.5*INTERVAL)
+            pid = loop.getpid()
+            loop.stop()
+        # emitted by the handler of the parent
+        assert len(h.records) >= 2
+        assert h.records[0].getMessage() == "tick 0"
+        assert all([r.process == pid for r in h.records])
+    finally:
+        l.removeHandler(h)
+
+def _app_logging_func(n):
+    logging.getLogger('test_loop_logging.app').warning("tick %s", n.value)
+    n.value += 1
+
+def test_loop_logging_own_handler():
+    # the handler of a non-root logger is inherited by the loop process, still
+    # each record is written exactly once (by the parent)
+    l = logging.getLogger('test_loop_logging.app')
+    for propagate in (True, False):
+        r, w = os.pipe()
+        stream = os.fdopen(w, 'w')
+        h = logging.StreamHandler(stream)
+        l.addHandler(h)
+        l.propagate = propagate
+        n = progression.UnsignedIntValue()
+        try:
+            with progression.Loop(func=_app_logging_func, args=(n,), interval=INTERVAL) as loop:
+                loop.start()
+                time.sleep(2.5*INTERVAL)
+                loop.stop()
+        finally:
+            l.removeHandler(h)
+            l.propagate = True
+            stream.close()
+        with os.fdopen(r) as f:
+            lines = f.read().splitlines()
+        assert n.value >= 2
+        assert lines == ["tick {}".format(i) for i in range(n.value)]
+
+def test_tick_metrics():
+    m = progression.TickMetrics(bins=8)
+    m.record('calc', 0)
+    m.record('calc', 3e-6)
+    m.record('calc', 3e-6)
+    m.record('calc', 1)
+    hist = m.histogram('calc')
+    assert [c for b, c in hist] == [1, 0, 2, 0, 0, 0, 0, 1]
+    assert hist[2][0] == 4e-6
+    assert hist[-1][0] is None
+    assert m.percentile('calc', 50) == 4e-6
+    assert m.percentile('calc', 99) == 1
+    assert m.percentile('tick', 50) is None
+    s = m.summary()
+    assert list(s.keys()) == ['calc']
+    assert s['calc']['count'] == 4
+    assert s['calc']['max'] == 1
+
+    m.add('format', 1e-3)
+    m.add('format', 1e-3)
+    assert m.pending('format') == 2e-3
+    m.commit()
+    assert m.summary()['format']['count'] == 1
+    assert m.pending('format') == 0
+
+def test_progress_metrics():
+    c = progression.UnsignedIntValue(val=0)
+    m = progression.UnsignedIntValue(val=100)
+    metrics = progression.TickMetrics(debug_line=True)
+    with progression.ProgressBar(count=c, max_count=m, interval=INTERVAL/5, line_log=False,
+                                 metrics=metrics) as sbm:
+        sbm.pipe_handler = _RecordingHandler()
+        sbm.start()
+        for i in range(10):
+            c.value += 1
+            time.sleep(INTERVAL/5)
+        sbm.stop()
+
+    s = metrics.summary()
+    assert sorted(s.keys()) == sorted(progression.TickMetrics.STAGES)
+    assert s['tick']['count'] >= 5
+    assert s['jitter']['count'] == s['tick']['count'] - 1
+    assert s['calc']['count'] == s['tick']['count']
+    assert s['write']['count'] >= 1
+    assert "calc " in "".join(sbm.pipe_handler.out)
+    assert "format " in metrics.format_line()
+
+def test_overhead_lock_acquisitions():
+    o = progression.LoopOverhead()
+    v = progression.UnsignedIntValue()
+    r = mp.RawValue('I', 0)
+    q = mp.Queue()
+    locks = [mp.Lock()]
+    args = (v, r, q, locks, {'x': [v]})
+    o.instrument(args)
+    assert o.lock_acquisitions == 0
+    v.value += 1            # read and write
+    r.value += 1            # no lock
+    with locks[0]:
+        pass
+    assert o.lock_acquisitions == 3
+    q.put(1)
+    q.get()
+    assert o.lock_acquisitions >= 5
+    # a new loop process starts counting from zero
+    o.instrument(args)
+    assert o.lock_acquisitions == 0
+    v.value
+    assert o.lock_acquisitions == 1
+    # the replaced lock can be copied
+    l = copy.copy(locks[0])
+    with l:
+        pass
+    assert o.lock_acquisitions == 2
+
+def _check_not_instrumented(v, locks, ok):
+    ok.value = (type(locks[0]) is type(mp.Lock())) and (v.acquire == v.get_lock().acquire)
+
+def test_loop_not_instrumented():
+    # the arguments of the user are left alone
+    v = progression.UnsignedIntValue()
+    ok = mp.Value('b', False, lock=False)
+    with progression.Loop(func=_check_not_instrumented, args=(v, [mp.Lock()], ok),
+                          interval=INTERVAL) as loop:
+        loop.start()
+        time.sleep(INTERVAL)
+        loop.stop()
+    assert ok.value
+    assert loop.overhead()['lock_acquisitions'] == 0
+
+def test_progress_overhead():
+    c = progression.UnsignedIntValue(val=0)
+    m = progression.UnsignedIntValue(val=100)
+    with progression.ProgressBar(count=c, max_count=m, interval=INTERVAL/5, line_log=False,
+                                 show_overhead=True) as sbm:
+        sbm.pipe_handler = _RecordingHandler()
+        assert sbm.overhead()['ipc_messages'] == 0
+        sbm.start()
+        for i in range(10):
+            c.value += 1
+            time.sleep(INTERVAL/5)
+        sbm.stop()
+
+    o = sbm.overhead()
+    assert o['cpu_time'] > 0
+    assert o['max_rss'] > 0
+    assert o['ipc_messages'] >= 5
+    assert 0 < o['terminal_bytes'] <= o['ipc_bytes']
+    # a frame with one bar reads at least 5 shared values of the bar
+    assert o['lock_acquisitions'] >= 5*5
+    assert 0 < o['cpu_fraction'] < 1
+    msgs = [x for x in sbm.pipe_handler.out if isinstance(x, tuple)]
+    assert len(msgs) == 1
+    assert msgs[0][1].startswith("overhead: CPU")
+    assert msgs[0][2] is False
+
 def test_why_with_statement():
     """
         here we demonstrate why you should use the with statement
@@ -973,6 +1519,19 @@ def test_humanize_time():
     assert progression.humanize_time(5.1234567) == '5.12s', "{}".format(progression.humanize_time(5.1234567))
     assert progression.humanize_time(123456) == '34:17:36', "{}".format(progression.humanize_time(123456))
     
+def test_humanize_speed():
+    assert progression.humanize_speed(12.345) == '12.3c/s'
+    assert progression.humanize_speed(0.5) == '30.0c/min'
+    assert progression.humanize_speed(1/3600) == '1.0c/h'
+    assert progression.humanize_speed(1/(3600*48)) == '0.5c/d'
+    assert progression.humanize_speed(0) == '0.0c/s'
+
+def test_humanize_time_cache():
+    assert progression.humanize_time(123456.7) == '34:17:36'
+    # cached value
+    assert progression.humanize_time(123456.2) == '34:17:36'
+    assert progression.humanize_time(10) == '00:00:10'
+
 def test_wrapper_termination():
     progression.log.setLevel(logging.DEBUG)
     
@@ -1032,6 +1591,186 @@ def test_codecov_subprocess_test():
     if p.is_alive():
         p.terminate()
 
+def test_line_log():
+    ll = progression.LineLog(interval=10, milestone=0.1)
+    assert ll.due(0, count_value=1, max_count_value=100, now=0)
+    # count unchanged
+    assert not ll.due(0, count_value=1, max_count_value=100, now=20)
+    # neither interval passed nor milestone crossed
+    assert not ll.due(0, count_value=5, max_count_value=100, now=1)
+    # milestone crossed
+    assert ll.due(0, count_value=10, max_count_value=100, now=2)
+    # interval passed
+    assert ll.due(0, count_value=11, max_count_value=100, now=12)
+    # forced
+    assert ll.due(0, count_value=11, max_count_value=100, now=12, force=True)
+    # no max_count -> interval only
+    assert ll.due(1, count_value=1, max_count_value=None, now=0)
+    assert not ll.due(1, count_value=50, max_count_value=None, now=5)
+
+    line = progression.LineLog.line(5, 10, progression.ESC_RED+'pre ', 1.1, 11, 100)
+    assert line == "pre 00:00:11 [1.1c/s] #5/10 50.0% TTG 00:01:40"
+    assert '\033' not in progression.LineLog.line(5, None, 'pre ', 1.1, 11, None)
+
+    c = progression.UnsignedIntValue(val=0)
+    m = progression.UnsignedIntValue(val=50)
+    try:
+        with progression.ProgressBar(count=c, max_count=m, interval=INTERVAL,
+                                     line_log=progression.LineLog(interval=INTERVAL)) as sc:
+            sc.start()
+            for i in range(50):
+                c.value += 1
+                time.sleep(INTERVAL/20)
+    finally:
+        _kill_pid(sc.getpid())
+
+def test_latest_frame_buffer():
+    E = progression.ESC_MY_MAGIC_ENDING
+    buf = progression.LatestFrameBuffer()
+    buf.put("plain")
+    buf.put("text")
+    assert buf.get() == "plaintext"
+
+    buf = progression.LatestFrameBuffer()
+    for f in ['1', '2', '3']:
+        buf.put("frame" + f + "\n")
+        buf.put(E)
+    assert buf.get() == "frame3\n" + E
+    assert buf.dropped == 2
+
+    # the beginning of frame 4 has been fetched, so frame 4 must be completed
+    buf.put("frame4\n")
+    assert buf.get() == "frame4\n"
+    buf.put("rest4" + E)
+    buf.put("frame5" + E)
+    buf.put("frame6" + E)
+    assert buf.get() == "rest4" + E + "frame6" + E
+    assert buf.dropped == 3
+
+    # an empty chunk does not protect the next frame
+    buf.put("")
+    assert buf.get() == ""
+    buf.put("frame7" + E)
+    buf.put("frame8" + E)
+    assert buf.get() == "frame8" + E
+    assert buf.dropped == 4
+
+    buf.close()
+    assert buf.get() is None
+
+def test_stdout_pipe_empty_write():
+    conn_recv, conn_send = mp.Pipe(False)
+    p = progression.StdoutPipe(conn_send)
+    p.write("")
+    p.write("frame")
+    assert conn_recv.recv() == "frame"
+    assert not conn_recv.poll()
+    assert p.messages == 1
+
+def test_slow_pipe_handler():
+    class SlowHandler(object):
+        def __call__(self, b):
+            time.sleep(INTERVAL)
+        def flush(self):
+            pass
+
+    c = progression.UnsignedIntValue(val=0)
+    m = progression.UnsignedIntValue(val=100)
+    try:
+        sc = progression.ProgressBar(count=c, max_count=m, interval=INTERVAL/20, line_log=False)
+        sc.pipe_handler = SlowHandler()
+        sc.start()
+        for i in range(100):
+            c.value += 1
+            time.sleep(INTERVAL/100)
+        t0 = time.time()
+        sc.stop()
+        # the frame being written, the latest frame and the final frame, not the backlog
+        assert time.time() - t0 < 4*INTERVAL
+        assert sc.dropped_frames > 0
+    finally:
+        _kill_pid(sc.getpid())
+
+def test_stop_with_busy_writer():
+    class ThreadHandler(object):
+        def __init__(self, delay):
+            self.delay = delay
+            self.threads = []
+        def __call__(self, b):
+            self.threads.append(threading.current_thread())
+            time.sleep(self.delay)
+        def flush(self):
+            pass
+
+    # interval 0: stop still waits for the writer, the final frame is written last
+    c = progression.UnsignedIntValue(val=0)
+    sc = progression.ProgressBar(count=c, interval=0, line_log=False)
+    sc.pipe_handler = ThreadHandler(0.01)
+    sc.start()
+    time.sleep(INTERVAL)
+    sc.stop()
+    assert sc.pipe_handler.threads[-1] is threading.current_thread()
+    assert threading.current_thread() not in sc.pipe_handler.threads[:-1]
+
+    # a writer blocked longer than the join timeout, the final frame is skipped
+    sc = progression.ProgressBar(count=c, interval=INTERVAL/20, line_log=False)
+    sc.pipe_handler = ThreadHandler(2*progression.progress._JOIN_TIMEOUT_MIN)
+    sc.start()
+    time.sleep(INTERVAL)
+    sc.stop()
+    assert threading.current_thread() not in sc.pipe_handler.threads
+
+def test_write_above_bars():
+    c = progression.UnsignedIntValue(val=0)
+    m = progression.UnsignedIntValue(val=20)
+    handler = _RecordingHandler()
+    log = logging.getLogger('test_write_above_bars')
+    try:
+        with progression.ProgressBar(count=c, max_count=m, interval=INTERVAL/5, line_log=False) as sc:
+            sc.pipe_handler = handler
+            log.addHandler(progression.LoopLogHandler(sc))
+            sc.start()
+            for i in range(20):
+                c.value += 1
+                if i == 10:
+                    sc.write("intermediate message")
+                    log.warning("log message")
+                time.sleep(INTERVAL/20)
+    finally:
+        _kill_pid(sc.getpid())
+
+    out = "".join(o for o in handler.out if not isinstance(o, tuple))
+    msgs = [o for o in handler.out if isinstance(o, tuple)]
+    assert msgs == [('msg', "intermediate message", True), ('msg', "log message", True)]
+    # each message is written between two frames and followed by a redraw of the last frame
+    for i, o in enumerate(handler.out):
+        if isinstance(o, tuple):
+            before = "".join(x for x in handler.out[:i] if not isinstance(x, tuple))
+            assert before.endswith(progression.ESC_MY_MAGIC_ENDING)
+    assert out.count(progression.ESC_MY_MAGIC_ENDING) >= 2
+
+def test_callable_pipe_handler():
+    # a plain callable has neither flush nor write_message
+    out = []
+    c = progression.UnsignedIntValue(val=0)
+    stdout = sys.stdout
+    with progression.ProgressBar(count=c, interval=INTERVAL/5, line_log=False,
+                                 show_overhead=True) as sc:
+        sc.pipe_handler = lambda b: out.append(b)
+        sc.start()
+        time.sleep(INTERVAL/5)
+        sc.write("intermediate message")
+        for i in range(5):
+            c.value += 1
+            time.sleep(INTERVAL/5)
+        sc.stop()
+    assert sys.stdout is stdout
+    assert sc._writer_thread is None or not sc._writer_thread.is_alive()
+    out = "".join(out)
+    assert "intermediate message\n" in out
+    assert "overhead: CPU" in out
+    assert out.count(progression.ESC_MY_MAGIC_ENDING) >= 2
+
 def test_ESC_SEQ():
     pr = progression
     s = pr.ESC_BOLD+"["
@@ -1056,6 +1795,44 @@ def test_ESC_SEQ():
     s_html = progression.ESC_SEQ_to_HTML(s)
     print(s_html)
 
+def test_len_string_without_ESC():
+    pr = progression
+    s = "hal"+pr.ESC_BOLD+"lo "+pr.ESC_MOVE_LINE_DOWN(4)+"welt"+pr.ESC_LIGHT_BLUE
+    assert pr.len_string_without_ESC(s) == len("hallo welt")
+    # cached value
+    assert pr.len_string_without_ESC(s) == len("hallo welt")
+    assert pr.len_string_without_ESC("hallo welt") == len("hallo welt")
+
+    s = (pr.ESC_RED + "pre" + pr.ESC_DEFAULT + "x"*10)*1000
+    assert pr.remove_ESC_SEQ_from_string(s) == ("pre" + "x"*10)*1000
+    assert pr.len_string_without_ESC(s) == 13*1000
+
+def test_ESC_SEQ_to_HTML():
+    pr = progression
+    s = pr.ESC_RED + "pre" + pr.ESC_DEFAULT + pr.ESC_GREEN + pr.ESC_BOLD + "[" + pr.ESC_RESET_BOLD + "bar" + pr.ESC_NO_CHAR_ATTR
+    html = ('<span style="color:#800000">pre</span><span style="color:#008000"><b>[</b>bar</span>')
+    assert pr.ESC_SEQ_to_HTML(s) == html
+    # second call is served from the line cache
+    assert pr.ESC_SEQ_to_HTML(s) == html
+
+    # changing the color while bold is on closes and reopens the bold tag
+    s = pr.ESC_RED + pr.ESC_BOLD + "a" + pr.ESC_GREEN + "b"
+    html = ('<span style="color:#800000"><b>a</b></span><b><span style="color:#008000">b</span></b>')
+    assert pr.ESC_SEQ_to_HTML(s) == html
+
+    # state is carried across lines, open tags are closed at the end
+    s = pr.ESC_BOLD + "a\nb" + pr.ESC_MOVE_LINE_UP(2) + pr.ESC_MY_MAGIC_ENDING
+    assert pr.ESC_SEQ_to_HTML(s) == "<b>a\nb</b>"
+
+def test_ESC_SEQ_to_HTML_lines():
+    pr = progression
+    s = (pr.ESC_RED + "_1_:" + pr.ESC_BOLD + "[==>]\n" +
+         "[=>  ]" + pr.ESC_NO_CHAR_ATTR + "\n" +
+         pr.ESC_MOVE_LINE_UP(2) + pr.ESC_MY_MAGIC_ENDING)
+    lines = pr.ESC_SEQ_to_HTML_lines(s)
+    assert lines == ['<span style="color:#800000">_1_:<b>[==>]</b></span>',
+                     '<span style="color:#800000"><b>[=>  ]</b></span>']
+
 def test_show_stat():
     kwargs = {'counter_count': [progression.UnsignedIntValue(10)],
               'counter_speed': [progression.UnsignedIntValue(1)],
@@ -1119,6 +1896,289 @@ def test_show_stat():
     progression.ProgressBarCounterFancy.show_stat(count_value=10, max_count_value=0, prepend='pre', speed=1.1, tet=11,
                                               ttg=100, width=80, i=0, **kwargs)
 
+def test_fancy_layout_cache():
+    pbf = progression.ProgressBarFancy
+    for width in [80, 60, 40, 30, 20, 10]:
+        for count_value in [0, 5, 10]:
+            args = (count_value/10, progression.humanize_time(11), '['+progression.humanize_speed(1.1)+']',
+                    progression.humanize_time(100), '20170101_00:00:00', progression.humanize_time(111),
+                    '-', width, 3, 7)
+            res = None
+            for layout in pbf._layouts:
+                res = getattr(pbf, layout)(*args)
+                if res is not None:
+                    break
+            assert pbf._choose_layout(args) == res
+            # second call uses the cached layout
+            assert pbf._choose_layout(args) == res
+
+    snapshot = progression.StatSnapshot(count_value=5, max_count_value=10, prepend='pre', speed=1.1, tet=11, ttg=None)
+    s1 = pbf.render(snapshot, 80, progression.COLTHM)
+    s2 = pbf.render(snapshot, 80, progression.COLTHM)
+    assert s1 == s2
+
+def test_fancy_kw_bold():
+    b = progression.ESC_BOLD
+    r = progression.ESC_RESET_BOLD
+    kw_bold = progression.ProgressBarFancy.kw_bold
+
+    assert kw_bold("TET-1.00s--TTG>", ch_after=('-', '>')) == b+"TET"+r+"-1.00s--"+b+"TTG"+r+">"
+    assert kw_bold("E 1.00s G 2.00s A x O 3.00s", ch_after=(' ',)) == (b+"E"+r+" 1.00s "+b+"G"+r+" 2.00s "+
+                                                                      b+"A"+r+" x "+b+"O"+r+" 3.00s")
+    assert kw_bold("ETA ORT", ch_after=(' ',)) == b+"ETA"+r+" ORT"
+    assert kw_bold("TETG-", ch_after=('-',)) == "TET"+b+"G"+r+"-"
+
+# the output of show_stat before the split into render functions, ETA {eta} depends on the timezone
+SHOW_STAT_BASELINE = {
+    ('ProgressBar', 10): '\x1b[0m\x1b[31mpre\x1b[39m00:00:11 [1.1c/s] \x1b[92m\x1b[1m[=====================>                      ]\x1b[22m\x1b[39m TTG 00:01:40\n',
+    ('ProgressBar', None): '\x1b[0m\x1b[31mpre\x1b[39m00:00:11 [1.1c/s] \x1b[1m\x1b[92m#5    \n',
+    ('ProgressBarCounter', 10): '\x1b[0m\x1b[31mpre\x1b[39m7.00s [1.0c/s] \x1b[92m#10\x1b[39m - 00:00:11 [1.1c/s] \x1b[92m\x1b[1m[===========>           ]\x1b[22m\x1b[39m TTG 00:01:40\n',
+    ('ProgressBarCounter', None): '\x1b[0m\x1b[31mpre\x1b[39m7.00s [1.0c/s] \x1b[92m#10\x1b[39m - 00:00:11 [1.1c/s] \x1b[92m#5\x1b[39m    \n',
+    ('ProgressBarFancy', 10): '\x1b[31mpre\x1b[39m\x1b[92m\x1b[1m[\x1b[22m\x1b[1mE\x1b[22m-00:00:11-----[1.1c/s]-\x1b[1mG\x1b[22m-00:01:40---50.\x1b[39m0%   \x1b[1mA\x1b[22m {eta} \x1b[1mO\x1b[22m 00:01:51\x1b[1m\x1b[92m]\x1b[0m\n',
+    ('ProgressBarFancy', None): '\x1b[31mpre\x1b[39m00:00:11 [1.1c/s] \x1b[92m#5\x1b[39m    \n',
+    ('ProgressBarCounterFancy', 10): '\x1b[0m\x1b[31mpre\x1b[39m7.00s [1.0c/s] \x1b[92m#10\x1b[39m - \x1b[31m\x1b[39m\x1b[92m\x1b[1m[\x1b[22m\x1b[1mE\x1b[22m-00:00:11-----[1.1c/s]-\x1b[1mG\x1b[22m-00\x1b[39m:01:40  50.0%   \x1b[1mO\x1b[22m 00:01:51\x1b[1m\x1b[92m]\x1b[0m\n',
+    ('ProgressBarCounterFancy', None): '\x1b[0m\x1b[31mpre\x1b[39m7.00s [1.0c/s] \x1b[92m#10\x1b[39m - 00:00:11 [1.1c/s] \x1b[92m#5\x1b[39m    \n',
+}
+
+def test_render_frame():
+    theme = progression.color_themes['term_default']
+    kwargs = {'counter_count': [progression.UnsignedIntValue(10)],
+              'counter_speed': [progression.FloatValue(1)],
+              'init_time': 0}
+    # counter_tet = 7s, ETA = wall_start + ttg
+    old_clock = progression.set_clock(progression.VirtualClock(start=7, wall_start=1.5e9))
+    try:
+        eta = datetime.datetime.fromtimestamp(1.5e9 + 100).strftime("%Y%m%d_%H:%M:%S")
+        for cls in [progression.ProgressBar, progression.ProgressBarCounter,
+                    progression.ProgressBarFancy, progression.ProgressBarCounterFancy]:
+            snapshots = [progression.Progress.snapshot(c, m, 'pre', 1.1, 11, 100, 0, **kwargs)
+                         for c, m in [(0, 10), (5, 10), (10, 10), (5, None)]]
+            frame = progression.render_frame(cls.render, snapshots, 80, theme, info_line="info")
+            # pure: same input, same frame
+            assert frame == progression.render_frame(cls.render, snapshots, 80, theme, info_line="info")
+            assert frame.endswith(progression.ESC_MOVE_LINE_UP(5) + progression.ESC_MY_MAGIC_ENDING)
+            lines = frame.split('\n')
+            assert len(lines) == 6
+            for l in lines[:3]:
+                assert progression.len_string_without_ESC(l) <= 80
+
+            for m in [10, None]:
+                myout = inMemoryBuffer()
+                stdout = sys.stdout
+                sys.stdout = myout
+                try:
+                    cls.show_stat(5, m, 'pre', 1.1, 11, 100, 80, 0, **kwargs)
+                finally:
+                    sys.stdout = stdout
+                assert myout.getvalue() == SHOW_STAT_BASELINE[(cls.__name__, m)].format(eta=eta)
+                snapshot = progression.Progress.snapshot(5, m, 'pre', 1.1, 11, 100, 0, **kwargs)
+                assert myout.getvalue() == cls.render(snapshot, 80, progression.COLTHM) + '\n'
+    finally:
+        progression.set_clock(old_clock)
+
+def test_show_stat_frame():
+    # the loop prints the frame built from the lines of all processes at once
+    class Writes(object):
+        def __init__(self):
+            self.out = []
+        def write(self, s):
+            self.out.append(s)
+        def flush(self):
+            pass
+
+    c = [progression.UnsignedIntValue(5), progression.UnsignedIntValue(7)]
+    m = [progression.UnsignedIntValue(10), progression.UnsignedIntValue(10)]
+    old_clock = progression.set_clock(progression.VirtualClock(start=0, wall_start=1.5e9))
+    try:
+        sbm = progression.ProgressBarFancy(count=c, max_count=m, width=80, line_log=False,
+                                           info_line=progression.StringValue(32))
+        sbm.info_line.value = b"info"
+        progression.get_clock().advance(3)
+        stdout = sys.stdout
+        sys.stdout = myout = Writes()
+        try:
+            sbm._show_stat()
+        finally:
+            sys.stdout = stdout
+        lines = []
+        for i in range(2):
+            speed = c[i].value / 3
+            lines.append(progression.ProgressBarFancy.stat_line(c[i].value, 10, '', speed, 3,
+                                                                math.ceil((10 - c[i].value) / speed), 80, i))
+        assert myout.out[0] == progression.join_frame(lines + ["info" + " "*76], move_up=False)
+        assert "".join(myout.out) == myout.out[0]
+    finally:
+        progression.set_clock(old_clock)
+
+    # a subclass which only implements show_stat still works, its output is captured
+    class MyBar(progression.ProgressBar):
+        @staticmethod
+        def show_stat(count_value, max_count_value, prepend, speed, tet, ttg, width, i, **kwargs):
+            print("my bar", count_value)
+    assert progression.stat_line_function(progression.ProgressBar) is progression.ProgressBar.stat_line
+    assert progression.stat_line_function(MyBar)(5, 10, '', 1, 1, 5, 80, 0) == "my bar 5"
+
+def test_column_layout():
+    pr = progression
+    columns = ['label', 'count', 'percent', 'bar', 'speed', 'tet', 'ttg', 'eta',
+               pr.Column('custom', width=4, func=lambda snapshot: 'abcdef')]
+    layout = pr.ColumnLayout(columns)
+    layout.set_label_width(4)
+    snapshot = pr.StatSnapshot(5, 10, 'pre', 1.1, 11, 100, 1.5e9)
+    for width in [120, 100, 80]:
+        line = layout.render(snapshot, width, pr.COLTHM)
+        assert pr.len_string_without_ESC(line) == width
+        assert width in layout._plans
+        stripped = pr.remove_ESC_SEQ_from_string(line)
+        assert stripped.startswith('pre ')
+        assert ' 50.0% [' in stripped
+        assert stripped.endswith(' abcd')
+
+    snapshot = pr.StatSnapshot(5, None, 'pre', 1.1, 11, None)
+    line = pr.remove_ESC_SEQ_from_string(layout.render(snapshot, 100, pr.COLTHM))
+    assert '[  ' in line
+
+    try:
+        pr.Column('custom')
+    except ValueError:
+        pass
+    else:
+        assert False, "ValueError expected"
+
+    c = [pr.UnsignedIntValue(val=0), pr.UnsignedIntValue(val=0)]
+    m = [pr.UnsignedIntValue(val=20), pr.UnsignedIntValue(val=20)]
+    try:
+        with pr.ProgressBarColumns(count=c, max_count=m, prepend=['a:', 'bb:'], interval=INTERVAL,
+                                   columns=columns, line_log=False) as sc:
+            sc.start()
+            for i in range(20):
+                c[0].value += 1
+                c[1].value += 1
+                time.sleep(INTERVAL/20)
+    finally:
+        _kill_pid(sc.getpid())
+
+def test_sparkline():
+    pr = progression
+    h = pr.SpeedHistory(size=4)
+    assert h.values() == ()
+    for v in [1, 2, 3]:
+        h.append(v)
+    assert h.values() == (1, 2, 3)
+    for v in [4, 5, 6]:
+        h.append(v)
+    assert h.values() == (3, 4, 5, 6)
+
+    assert pr.sparkline((0, 4, 8), 10) == pr.SPARK_GLYPHS[0] + pr.SPARK_GLYPHS[4] + pr.SPARK_GLYPHS[7]
+    assert pr.sparkline((1, 2, 8), 1) == pr.SPARK_GLYPHS[7]
+    assert pr.sparkline((0, 0), 2) == pr.SPARK_GLYPHS[0]*2
+    assert pr.sparkline((), 2) == ''
+
+    c = pr.UnsignedIntValue(val=0)
+    m = pr.UnsignedIntValue(val=20)
+    try:
+        with pr.ProgressBarColumns(count=c, max_count=m, interval=INTERVAL/5,
+                                   columns=['label', 'bar', 'spark', 'speed'], line_log=False) as sc:
+            sc.start()
+            for i in range(20):
+                c.value += 1
+                time.sleep(INTERVAL/20)
+            time.sleep(INTERVAL)
+            # the history is written by the loop process into shared memory
+            assert len(sc.add_args['speed_history'][0].values()) > 1
+    finally:
+        _kill_pid(sc.getpid())
+
+def test_render_budget():
+    pr = progression
+    b = pr.RenderBudget(cpu_budget=0.01, interval=1, min_bars=2, max_frame_skip=4, patience=2)
+    assert b.max_level == 4
+    assert b.show_stat_function(pr.ProgressBarFancy.show_stat) is pr.ProgressBarFancy.show_stat
+
+    for i in range(2):
+        b.update(0.1)
+    assert b.level == 1
+    assert b.show_stat_function(pr.ProgressBarFancy.show_stat) is pr.ProgressBar.show_stat
+    assert b.show_stat_function(pr.ProgressBarCounterFancy.show_stat) is pr.ProgressBarCounter.show_stat
+    assert b.visible_bars(10) == 10
+
+    for i in range(2):
+        b.update(0.1)
+    assert b.level == 2
+    assert b.visible_bars(10) == 2
+
+    for i in range(10):
+        b.update(0.1)
+    assert b.level == 4
+    assert b.frame_every == 4
+    assert [b.skip_frame() for i in range(4)].count(False) == 1
+
+    # recover when the load drops
+    for i in range(20):
+        b.update(0)
+    assert b.level == 0
+
+    n = 6
+    count = [pr.UnsignedIntValue(0) for i in range(n)]
+    max_count = [pr.UnsignedIntValue(20) for i in range(n)]
+    budget = pr.RenderBudget(cpu_budget=1e-9, interval=INTERVAL/10, min_bars=2, patience=1)
+    try:
+        with pr.ProgressBarFancy(count=count, max_count=max_count, interval=INTERVAL/10,
+                                 cpu_budget=budget, line_log=False) as sc:
+            sc.start()
+            for x in range(20):
+                for c in count:
+                    c.value += 1
+                time.sleep(INTERVAL/20)
+    finally:
+        _kill_pid(sc.getpid())
+
+def test_virtual_clock():
+    clock = progression.VirtualClock(start=100, wall_start=1000)
+    old_clock = progression.set_clock(clock)
+    try:
+        assert progression.get_clock() is clock
+        c = progression.UnsignedIntValue(val=0)
+        m = progression.UnsignedIntValue(val=100)
+        sbm = progression.ProgressBar(count=c, max_count=m, speed_calc_cycles=2)
+        args = (sbm.count[0], sbm.last_count[0], sbm.start_time[0], sbm.max_count[0],
+                sbm.speed_calc_cycles, sbm.q[0], sbm.last_speed[0], sbm.lock[0])
+        assert sbm.start_time[0].value == 100
+
+        for frame in range(1, 5):
+            clock.advance(2)
+            c.value = 10*frame
+            count_value, max_count_value, speed, tet, ttg = progression.Progress._calc(*args)
+            assert tet == 2*frame
+            assert speed == 5
+            assert ttg == (100 - 10*frame) / 5
+        snapshot = progression.Progress.snapshot(count_value, max_count_value, '', speed, tet, ttg)
+        assert snapshot.eta == 1008 + 12
+
+        # the loop process follows the clock, sleep advances it instead of waiting
+        clock.auto_advance = True
+        n = progression.UnsignedIntValue(val=0)
+        def f(n):
+            n.value += 1
+        with progression.Loop(func=f, args=(n,), interval=3600) as loop:
+            loop.start()
+            time.sleep(0.5)
+        assert n.value > 10
+        assert clock.time() > 100 + 3600*10
+    finally:
+        progression.set_clock(old_clock)
+    assert isinstance(progression.get_clock(), progression.MonotonicClock)
+
+def test_benchmarks():
+    bench = os.path.join(split(dirname(abspath(__file__)))[0], 'benchmarks', 'bench_progress.py')
+    out = subprocess.check_output([sys.executable, bench, '--quick', '-k', 'calc', '-k', 'loop'])
+    res = json.loads(out.decode())
+    assert res['version'] == progression.__version__
+    names = [r['name'] for r in res['results']]
+    assert names == ['calc', 'calc', 'loop', 'loop']
+    for r in res['results']:
+        assert 0 < r['best'] <= r['median']
+
 def test_example_StdoutPipe():
     import sys
     from multiprocessing import Pipe